@@ -1,12 +1,27 @@
+import csv
+import hashlib
+import itertools
+import json
 import os
-from statistics import mean
-from typing import List
+import sqlite3
+import sys
+import time
+from functools import lru_cache, partial
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 from influxdb import InfluxDBClient
 import click
 
+# The run store format and the metrics shared with the observers come from the simulator's own
+# modules, so that runs are read as they are written and measured as they are during a run.
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "simulator"))
+from metrics import clustering, dead_links  # noqa: E402
+from store import EVENT_DTYPE, Event, RunWriter, frame_dtype, read_header, views_frame_dtype  # noqa: E402
+
 plt.rcParams.update({"font.size": 22})
 
 
@@ -38,59 +53,68 @@ def cli3():
 @click.option("-r", "--repetitions", type=int, default=2)
 @click.option("--influx", is_flag=True)
 @click.option("-f", "--folder", type=str)
+@click.option("--path-sources", type=int, help="Estimate path lengths from this many sampled BFS sources.")
+@click.option("--path-error", type=float,
+              help="Sample BFS sources until the 95%% interval of the path length is within this relative error.")
+@click.option("--clustering-samples", type=int, help="Estimate clustering from this many sampled nodes.")
+@click.option("-j", "--jobs", type=int, default=1,
+              help="Number of processes running BFS source blocks and eviction repetitions.")
 def static(run: str, tick: List[int], dd: bool, pth: bool, cc: bool, mtx: bool,
-           pt: bool, all: bool, repetitions: int, influx: bool, folder: str):
+           pt: bool, all: bool, repetitions: int, influx: bool, folder: str, path_sources: int,
+           path_error: float, jobs: int, clustering_samples: int):
+    if influx:
+        load_influx_run(run, folder)
+    info = info_from_files(run, folder)
+    check_ticks(run, folder, tick)
+    cache = MetricCache(run, folder)
     for i, t in enumerate(tick):
-        if influx:
-            graph = network_from_influx(run, t)
-            info = info_from_influx(run, folder)
-        else:
-            graph = network_from_files(run, t, folder)
-            info = info_from_files(run, folder)
+        overlay = overlay_from_files(run, t, folder)
+        graph = lru_cache(maxsize=None)(overlay.to_networkx)
+        metric = partial(cache.metric, t, overlay)
         if dd or all:
-            degrees = [graph.degree(n) for n in graph.nodes()]
-            plt.hist(degrees)
+            plt.hist(sum(degrees(overlay)))
             plt.ylabel("nodes amount")
             plt.xlabel("degree")
-            plt.title(f"N={graph.number_of_nodes()}, Tick={t} - Degree distribution")
+            plt.title(f"N={overlay.nodes}, Tick={t} - Degree distribution")
             plt.show()
         if cc or all:
-            coefficients = [cc for cc in nx.clustering(graph).values()]
+            sampled = dict(samples=clustering_samples, seed=t)
+            nodes = sample_nodes(overlay.nodes, **sampled)
+            coefficients = metric("clustering", lambda: clustering(overlay, nodes).tolist(), **sampled)
             plt.hist(coefficients)
-            plt.title(f"N={graph.number_of_nodes()}, Tick={t} - Clustering coefficient distribution")
+            plt.title(f"N={overlay.nodes}, Tick={t} - Clustering coefficient distribution")
             plt.show()
         if pth or all:
-            avg_shortest_paths = [mean(lengths.values()) for scr, lengths in nx.all_pairs_shortest_path_length(graph)]
-            plt.hist(avg_shortest_paths)
-            plt.title(f"N={graph.number_of_nodes()}, Tick={t} - Average shortest path length distribution")
+            options = dict(sources=path_sources, error=path_error, seed=t)
+            path = metric("path_lengths", lambda: path_lengths(overlay, jobs=jobs, **options)._asdict(), **options)
+            if path["reachable"] < 1:
+                print(f"Tick {t} - Not strongly connected: {path['reachable']:.2%} of the node pairs are reachable")
+            plt.hist(path["per_source"])
+            plt.title(f"N={overlay.nodes}, Tick={t} - Average shortest path length distribution "
+                      f"({path['sources']} sources, mean {path['mean']:.3f} [{path['low']:.3f}, {path['high']:.3f}])")
+            plt.show()
+            plt.bar(range(1, len(path["histogram"]) + 1), path["histogram"])
+            plt.ylabel("node pairs")
+            plt.xlabel("distance")
+            plt.title(f"N={overlay.nodes}, Tick={t} - Distance distribution, diameter {path['diameter']}")
             plt.show()
         if mtx or all:
-            matrix = nx.to_numpy_matrix(graph)
+            matrix = nx.to_numpy_matrix(graph())
             plt.matshow(matrix, cmap=plt.cm.Blues, fignum=i)
-            plt.title(f"N={graph.number_of_nodes()} - Adjacency matrix")
+            plt.title(f"N={overlay.nodes} - Adjacency matrix")
             plt.show()
         if pt or all:
-            y = []
-            for p in range(1, 100):
-                print(f"Calculating if there is partition evicting {p}% of the nodes")
-                avgs = []
-                for _ in range(repetitions):
-                    g2 = graph.to_undirected()
-                    evict_nodes = np.random.choice(g2.nodes, int(g2.number_of_nodes() * (p / 100)), replace=False)
-                    g2.remove_nodes_from(evict_nodes)
-                    partition_lens = [len(c) for c in sorted(nx.connected_components(g2), key=len, reverse=True)]
-                    if len(partition_lens) > 1:
-                        avgs.append(sum(partition_lens[1:]) / graph.number_of_nodes())
-                    else:
-                        avgs.append(0)
-                y.append(mean(avgs))
+            y = metric("partition_resistance", lambda: partition_resistance(overlay, repetitions, seed=t, jobs=jobs),
+                       repetitions=repetitions, seed=t)
             plt.ylabel("Proportion of nodes outside of largest cluster")
             plt.xlabel("Evicted % of nodes")
-            plt.plot(y, label=info)
+            plt.plot(range(1, 100), y["mean"], label=info)
+            plt.fill_between(range(1, 100), y["low"], y["high"], alpha=0.3)
             plt.legend()
             plt.xticks([step for step in range(0, 105, 5)])
-            plt.title(f"N={graph.number_of_nodes()}, Tick={t} - Partition resistance")
+            plt.title(f"N={overlay.nodes}, Tick={t} - Partition resistance")
             plt.show()
+    cache.close()
 
 
 @cli2.command()
@@ -108,8 +132,22 @@ def static(run: str, tick: List[int], dd: bool, pth: bool, cc: bool, mtx: bool,
 @click.option("-all", is_flag=True)
 @click.option("--influx", is_flag=True)
 @click.option("-f", "--folder", type=str)
+@click.option("-s", "--summary", type=click.Path(exists=True, dir_okay=False),
+              help="Sweep summary table to select runs from by parameter.")
+@click.option("-w", "--where", multiple=True, type=str,
+              help="Parameter filter on the summary table, e.g. 'c=32'.")
+@click.option("-j", "--jobs", type=int, default=1, help="Number of processes computing tick metrics.")
+@click.option("--path-sources", type=int, help="Estimate path lengths from this many sampled BFS sources.")
+@click.option("--path-error", type=float,
+              help="Sample BFS sources until the 95%% interval of the path length is within this relative error.")
+@click.option("--clustering-samples", type=int, help="Estimate clustering from this many sampled nodes.")
 def dynamic(runs: str, ticks: int, c: bool, nd: bool, pth: bool, cc: bool, nid: bool,
-            pt: bool, ptb: bool, ptr: bool, repetitions: int, all: bool, influx: bool, folder: str):
+            pt: bool, ptb: bool, ptr: bool, repetitions: int, all: bool, influx: bool, folder: str,
+            summary: str, where: List[str], jobs: int, path_sources: int, path_error: float,
+            clustering_samples: int):
+    if summary:
+        runs = list(runs) + runs_from_summary(summary, where)
+        folder = folder or os.path.dirname(summary)
     CCs = [[] for _ in range(len(runs))]
     PTHs = [[] for _ in range(len(runs))]
     CDs = [[] for _ in range(len(runs))]
@@ -118,67 +156,53 @@ def dynamic(runs: str, ticks: int, c: bool, nd: bool, pth: bool, cc: bool, nid:
     PTRs = [[] for _ in range(len(runs))]
     Ns = [[] for _ in range(len(runs))]
     INFOs = []
+    partitions = []
     tick = 0
     for i, run in enumerate(runs):
         print(i, run)
         n, partitions_n = size_and_partitions(folder, influx, run, ticks)
+        check_ticks(run, folder, range(1, ticks + 1))
         if not influx:
             info = info_from_files(run, folder)
             INFOs.append(info)
         else:
             info = info_from_influx(run, folder)
             INFOs.append(info)
-        ccs = CCs[i]
-        pths = PTHs[i]
-        cds = CDs[i]
-        rds = RDs[i]
-        pts = PTs[i]
-        ns = Ns[i]
         for _ in range(partitions_n):
-            pts.append([])
+            PTs[i].append([])
+        partitions.append(partitions_n)
 
-        for tick in range(1, ticks + 1):
-            if not any([nd, pth, cc, nid, pt, ptb, c]):
-                continue
-            print(f"({run}) Calculating tick {tick}")
-            if influx:
-                g = network_from_influx(run, tick)
-            else:
-                g = network_from_files(run, tick, folder)
-            if not g or g.number_of_nodes() == 0:
-                tick -= 1
-                break
-            if c or all:
-                print(f"({run}) Tick {tick} - Is connected: {nx.is_weakly_connected(g)}")
-            if cc or all:
-                print(f"({run}) Tick {tick} - Calculating average clustering coefficient")
-                ccs.append(nx.average_clustering(g))
-            if pth or all:
-                print(f"({run}) Tick {tick} - Calculating average shortest path length")
-                try:
-                    pths.append(nx.average_shortest_path_length(g))
-                except nx.NetworkXError:
-                    pass
-            if nd or all:
-                print(f"({run}) Tick {tick} - Calculating average node degree")
-                cds.append(mean([len(g.in_edges(n)) + len(g.out_edges(n)) for n in g.nodes]))
-            if nid or all:
-                print(f"({run}) Tick {tick} - Calculating average node indegree")
-                rds.append(mean([len(g.in_edges(n)) for n in g.nodes]))
-            if pt or ptb or all:
-                print(f"({run}) Tick {tick} - Calculating partition remember time")
-                N = 0
-                dead_links = [0 for _ in range(partitions_n)]
-                for node, data in g.nodes(data=True):
-                    for e in g.in_edges(node):
-                        p1, p2 = int(g.nodes[e[0]]["cluster"]), int(g.nodes[e[1]]["cluster"])
-                        if p1 == 0 and p2 != 0:
-                            dead_links[p2] += 1
-                    if int(data["cluster"]) == 0:
-                        N += 1
-                for j, deadlink in enumerate(dead_links):
-                    pts[j].append(deadlink)
-                ns.append(N)
+    metrics = [name for name, wanted in (("weakly_connected", c), ("average_clustering", cc),
+                                         ("path_lengths", pth), ("degree", nd), ("indegree", nid),
+                                         ("dead_links", pt or ptb)) if wanted or all]
+    if not any([nd, pth, cc, nid, pt, ptb, c]):
+        tick = ticks
+        metrics = []
+    options = {"path_sources": path_sources, "path_error": path_error, "clustering_samples": clustering_samples}
+    for i, (run, results) in enumerate(zip(runs, run_metrics(runs, ticks, folder, metrics, partitions, jobs,
+                                                             options))):
+        for tick, values in enumerate(results, start=1):
+            if "weakly_connected" in values:
+                print(f"({run}) Tick {tick} - Is connected: {values['weakly_connected']}")
+            if "average_clustering" in values:
+                CCs[i].append(values["average_clustering"])
+            if "path_lengths" in values:
+                path = values["path_lengths"]
+                if path["reachable"] < 1:
+                    print(f"({run}) Tick {tick} - Not strongly connected: "
+                          f"{path['reachable']:.2%} of the node pairs are reachable")
+                PTHs[i].append((path["mean"], path["low"], path["high"]))
+            if "degree" in values:
+                CDs[i].append(histogram_summary(values["degree"]))
+            if "indegree" in values:
+                RDs[i].append(histogram_summary(values["indegree"]))
+            if "dead_links" in values:
+                links, N = values["dead_links"]
+                for j, deadlink in enumerate(links):
+                    PTs[i][j].append(deadlink)
+                Ns[i].append(N)
+        if metrics:
+            tick = len(results)
 
     if cc or all:
         for ccs, info in zip(CCs, INFOs):
@@ -190,7 +214,10 @@ def dynamic(runs: str, ticks: int, c: bool, nd: bool, pth: bool, cc: bool, nid:
         plt.show()
     if pth or all:
         for pths, info in zip(PTHs, INFOs):
-            plt.plot(pths, label=info)
+            means, lows, highs = zip(*pths) if pths else ((), (), ())
+            plt.plot(means, label=info)
+            if path_sources or path_error:
+                plt.fill_between(range(len(means)), lows, highs, alpha=0.3)
         plt.legend()
         plt.ylabel("average path length")
         plt.xlabel("tick")
@@ -198,34 +225,29 @@ def dynamic(runs: str, ticks: int, c: bool, nd: bool, pth: bool, cc: bool, nid:
         plt.show()
     if nd or all:
         for cds, info in zip(CDs, INFOs):
-            plt.plot(cds, label=info)
+            means, lows, highs = zip(*cds) if cds else ((), (), ())
+            plt.plot(means, label=info)
+            plt.fill_between(range(len(means)), lows, highs, alpha=0.2)
         plt.legend()
-        plt.ylabel("average node degree")
+        plt.ylabel("average node degree (5-95th percentile)")
         plt.xlabel("tick")
         # plt.title(f"N={n}, Ticks={tick} - Network average node degree")
         plt.show()
     if nid or all:
         for rds, info in zip(RDs, INFOs):
-            plt.plot(rds, label=info)
+            means, lows, highs = zip(*rds) if rds else ((), (), ())
+            plt.plot(means, label=info)
+            plt.fill_between(range(len(means)), lows, highs, alpha=0.2)
         plt.legend()
-        plt.ylabel("average node indegree")
+        plt.ylabel("average node indegree (5-95th percentile)")
         plt.xlabel("tick")
         # plt.title(f"N={n}, Tick={tick} - Network average node indegree")
         plt.show()
     if pt or all:
-        if influx:
-            g = network_from_influx(runs[0], tick)
-        else:
-            g = network_from_files(runs[0], tick, folder)
-        partitions = []
-        for node in g.nodes:
-            p = int(g.nodes[node]["cluster"])
-            while len(partitions) <= p:
-                partitions.append(0)
-            partitions[p] += 1
-
+        overlay = overlay_from_files(runs[0], tick, folder)
+        partitions = np.bincount(overlay.cluster).tolist()
         partition_tick = next((i for i, x in enumerate(PTs[0][1]) if x), None)
-        dmax = max(sorted([d for _, d in g.out_degree()], reverse=True))
+        dmax = int(degrees(overlay)[1].max())
 
 
         plt.ylabel("proportion of deadlinks")
@@ -236,23 +258,14 @@ def dynamic(runs: str, ticks: int, c: bool, nd: bool, pth: bool, cc: bool, nid:
             plt.plot([deadlinks_n / (partitions[0] * dmax) for deadlinks_n in pt[partition_tick:]], label=info)
         plt.legend()
         # plt.title(
-        #   f"N={n}, Ticks={tick}, Partition={(partitions[0]) / g.number_of_nodes()} - Network partition remember time")
+        #   f"N={n}, Ticks={tick}, Partition={(partitions[0]) / overlay.nodes} - Network partition remember time")
         plt.show()
 
     if ptb or all:
-        if influx:
-            g = network_from_influx(runs[0], tick)
-        else:
-            g = network_from_files(runs[0], tick, folder)
-        partitions = []
-        for node in g.nodes:
-            p = int(g.nodes[node]["cluster"])
-            while len(partitions) <= p:
-                partitions.append(0)
-            partitions[p] += 1
-
+        overlay = overlay_from_files(runs[0], tick, folder)
+        partitions = np.bincount(overlay.cluster).tolist()
         partition_tick = next((i for i, x in enumerate(PTs[0][1]) if x), None)
-        dmax = max(sorted([d for _, d in g.out_degree()], reverse=True))
+        dmax = int(degrees(overlay)[1].max())
 
         plt.ylabel("proportion of deadlinks")
         plt.xlabel("ticks")
@@ -273,33 +286,20 @@ def dynamic(runs: str, ticks: int, c: bool, nd: bool, pth: bool, cc: bool, nid:
                 plt.bar(x, y, bottom=bottom, label=label)
         plt.legend()
         # plt.title(
-        #   f"N={n}, Ticks={tick}, Partition={(partitions[0]) / g.number_of_nodes()} - Network partition remember time")
+        #   f"N={n}, Ticks={tick}, Partition={(partitions[0]) / overlay.nodes} - Network partition remember time")
         plt.show()
     if ptr or all:
         for ri, run in enumerate(runs):
-            if influx:
-                g = network_from_influx(runs[0], tick)
-                info = info_from_influx(runs[0], folder)
-            else:
-                g = network_from_files(runs[0], tick, folder)
-                info = info_from_files(run, folder)
-            ptr = PTRs[ri]
-            for p in range(1, 70):
-                ptr.append(0)
-            for p in range(70, 100):
-                print(f"({run}) Calculating if there is partition evicting {p}% of the nodes")
-                avgs = []
-                for _ in range(repetitions):
-                    g2 = g.to_undirected()
-                    evict_nodes = np.random.choice(g2.nodes, int(g2.number_of_nodes() * (p / 100)), replace=False)
-                    g2.remove_nodes_from(evict_nodes)
-                    partition_lens = [len(c) for c in sorted(nx.connected_components(g2), key=len, reverse=True)]
-                    if len(partition_lens) > 1:
-                        avgs.append((sum(partition_lens[1:]) / g.number_of_nodes()) * 100)
-                    else:
-                        avgs.append(0)
-                ptr.append(mean(avgs))
-            plt.plot(ptr, label=info)
+            print(f"({run}) Calculating partition resistance")
+            overlay = overlay_from_files(run, tick, folder)
+            with MetricCache(run, folder) as cache:
+                ptr = cache.metric(tick, overlay, "partition_resistance",
+                                   lambda: partition_resistance(overlay, repetitions, seed=tick, jobs=jobs),
+                                   repetitions=repetitions, seed=tick)
+            PTRs[ri] = ptr
+            percent = range(1, 100)
+            plt.plot(percent, [100 * y for y in ptr["mean"]], label=INFOs[ri])
+            plt.fill_between(percent, [100 * y for y in ptr["low"]], [100 * y for y in ptr["high"]], alpha=0.3)
         plt.ylabel("% of partitioned nodes")
         plt.xlabel("Evicted % of nodes")
         plt.legend()
@@ -308,96 +308,722 @@ def dynamic(runs: str, ticks: int, c: bool, nd: bool, pth: bool, cc: bool, nid:
         plt.show()
 
 
+TICK_METRICS = {
+    "weakly_connected": nx.is_weakly_connected,
+}
+
+WORKER_CACHES = {}
+
+
+def run_metrics(runs: List[str], ticks: int, folder: str, metrics: List[str], partitions: List[int],
+                jobs: int, options: Dict[str, object] = None) -> List[List[Dict[str, object]]]:
+    # Metrics of every tick of every run, in tick order and up to the last tick of each run.
+    results = [{} for _ in runs]
+    if not metrics:
+        return [[] for _ in runs]
+    progress = Progress(len(runs) * ticks)
+    if jobs > 1:
+        for run in runs:
+            # Settle the cache of each run before the workers open it concurrently.
+            MetricCache(run, folder).close(evict=False)
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(tick_metrics, run, tick, folder, metrics, partitions_n, options): (i, tick)
+                       for i, (run, partitions_n) in enumerate(zip(runs, partitions))
+                       for tick in range(1, ticks + 1)}
+            for future in as_completed(futures):
+                i, tick = futures[future]
+                results[i][tick] = future.result()
+                progress.update()
+        for run in runs:
+            MetricCache(run, folder, settled=True).close()
+    else:
+        for i, (run, partitions_n) in enumerate(zip(runs, partitions)):
+            with MetricCache(run, folder) as cache:
+                for tick, overlay in overlays_from_files(run, ticks, folder):
+                    if overlay is None or overlay.nodes == 0:
+                        break
+                    results[i][tick] = compute_metrics(cache, tick, overlay, metrics, partitions_n, options)
+                    progress.update()
+    progress.done()
+    ordered = []
+    for run_results in results:
+        values = list(itertools.takewhile(lambda v: v is not None,
+                                          (run_results.get(tick) for tick in range(1, ticks + 1))))
+        ordered.append(values)
+    return ordered
+
+
+def tick_metrics(run: str, tick: int, folder: str, metrics: List[str], partitions_n: int,
+                 options: Dict[str, object] = None) -> Dict[str, object]:
+    # Runs in the worker processes, which load their overlay themselves and keep the cache of
+    # every run they have seen open.
+    overlay = overlay_from_files(run, tick, folder)
+    if overlay is None or overlay.nodes == 0:
+        return None
+    if run not in WORKER_CACHES:
+        WORKER_CACHES[run] = MetricCache(run, folder, settled=True)
+    return compute_metrics(WORKER_CACHES[run], tick, overlay, metrics, partitions_n, options)
+
+
+def compute_metrics(cache: "MetricCache", tick: int, overlay: "Overlay", metrics: List[str],
+                    partitions_n: int, options: Dict[str, object] = None) -> Dict[str, object]:
+    # The graph is only built for metrics missing from the cache.
+    g = lru_cache(maxsize=None)(overlay.to_networkx)
+    options = options or {}
+    values = {}
+    for name in metrics:
+        if name == "dead_links":
+            values[name] = cache.metric(tick, overlay, name, lambda: dead_links(overlay, partitions_n),
+                                        partitions=partitions_n)
+        elif name == "degree":
+            values[name] = cache.metric(tick, overlay, name, lambda: np.bincount(sum(degrees(overlay))).tolist())
+        elif name == "indegree":
+            values[name] = cache.metric(tick, overlay, name, lambda: np.bincount(degrees(overlay)[0]).tolist())
+        elif name == "average_clustering":
+            sampled = dict(samples=options.get("clustering_samples"), seed=tick)
+            values[name] = cache.metric(tick, overlay, name, lambda: average_clustering(overlay, **sampled), **sampled)
+        elif name == "path_lengths":
+            path = dict(sources=options.get("path_sources"), error=options.get("path_error"), seed=tick)
+            values[name] = cache.metric(tick, overlay, name, lambda: path_lengths(overlay, **path)._asdict(), **path)
+        else:
+            values[name] = cache.metric(tick, overlay, name, lambda: TICK_METRICS[name](g()))
+    return values
+
+
+class Progress:
+    def __init__(self, total: int, interval: float = 5.0):
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.started = self.reported = time.perf_counter()
+
+    def update(self):
+        self.count += 1
+        if time.perf_counter() - self.reported >= self.interval:
+            self.reported = time.perf_counter()
+            self.report()
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"{self.count}/{self.total} ticks - {self.count / elapsed if elapsed else 0:.2f} ticks/s")
+
+    def done(self):
+        self.report()
+
+
+def partition_resistance(overlay: "Overlay", repetitions: int, seed: int = None,
+                         jobs: int = 1) -> Dict[str, List[float]]:
+    # Proportion of nodes outside the largest undirected component after evicting 1..99% of the
+    # nodes: mean over random eviction orders with a 95% confidence interval.
+    src = np.repeat(np.arange(overlay.nodes), np.diff(overlay.indptr))
+    edges = np.unique(np.sort(np.stack((src, overlay.indices)), axis=0), axis=1)
+    edges = edges[:, edges[0] != edges[1]]
+    seeds = np.random.SeedSequence(seed).spawn(repetitions)
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            curves = list(executor.map(eviction_curve, itertools.repeat(overlay.nodes), itertools.repeat(edges), seeds))
+    else:
+        curves = [eviction_curve(overlay.nodes, edges, s) for s in seeds]
+    curves = np.array(curves)
+    mean = curves.mean(axis=0)
+    half = 1.96 * curves.std(axis=0, ddof=1) / np.sqrt(repetitions) if repetitions > 1 else np.zeros_like(mean)
+    return {"mean": mean.tolist(), "low": (mean - half).tolist(), "high": (mean + half).tolist()}
+
+
+def eviction_curve(n: int, edges: np.ndarray, seed: np.random.SeedSequence) -> List[float]:
+    # Newman-Ziff: nodes come back in the reverse of a random eviction order, each edge joining the
+    # union-find once both its ends are back, and the largest component is read off whenever the
+    # number of nodes left matches one of the eviction percentages.
+    order = np.random.default_rng(seed).permutation(n)
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n - 1, -1, -1)
+    arrival = np.maximum(rank[edges[0]], rank[edges[1]]) + 1
+    by_arrival = np.argsort(arrival, kind="stable")
+    arrival = arrival[by_arrival].tolist()
+    us, vs = edges[0, by_arrival].tolist(), edges[1, by_arrival].tolist()
+
+    parent = list(range(n))
+    size = [1] * n
+    largest = 1
+    e = 0
+    curve = []
+    for p in range(99, 0, -1):
+        left = n - int(n * (p / 100))
+        while e < len(arrival) and arrival[e] <= left:
+            u, v = us[e], vs[e]
+            while parent[u] != u:
+                parent[u] = parent[parent[u]]
+                u = parent[u]
+            while parent[v] != v:
+                parent[v] = parent[parent[v]]
+                v = parent[v]
+            if u != v:
+                if size[u] < size[v]:
+                    u, v = v, u
+                parent[v] = u
+                size[u] += size[v]
+                largest = max(largest, size[u])
+            e += 1
+        curve.append((left - min(largest, left)) / n)
+    return curve[::-1]
+
+
+def degrees(overlay: "Overlay") -> Tuple[np.ndarray, np.ndarray]:
+    return np.bincount(overlay.indices, minlength=overlay.nodes), np.diff(overlay.indptr)
+
+
+def histogram_summary(histogram: List[int], low: float = 0.05, high: float = 0.95) -> Tuple[float, int, int]:
+    # Mean and percentiles of the per-node values counted by the histogram.
+    histogram = np.asarray(histogram)
+    cumulative = np.cumsum(histogram)
+    mean = float(np.arange(len(histogram)) @ histogram / cumulative[-1])
+    low, high = np.searchsorted(cumulative, [low * cumulative[-1], high * cumulative[-1]])
+    return mean, int(low), int(high)
+
+
+def sample_nodes(n: int, samples: int = None, seed: int = 0) -> np.ndarray:
+    if samples is None or samples >= n:
+        return None
+    return np.sort(np.random.default_rng(seed).choice(n, samples, replace=False))
+
+
+def average_clustering(overlay: "Overlay", samples: int = None, seed: int = 0) -> float:
+    # Mean over uniformly sampled nodes when `samples` is given, as nx.approximation.average_clustering.
+    return float(clustering(overlay, sample_nodes(overlay.nodes, samples, seed)).mean())
+
+
+def runs_from_summary(summary_file: str, where: List[str]) -> List[str]:
+    filters = [tuple(w.split("=", 1)) for w in where]
+    with open(summary_file, newline="") as file:
+        return [row["run"] for row in csv.DictReader(file, delimiter="\t")
+                if all(row.get(name) == value for name, value in filters)]
+
+
+def check_ticks(run: str, folder: str, ticks: Iterable[int]):
+    # Out-of-core runs store the views of a few ticks only; ticks past the end of a run are fine.
+    store_file = os.path.join(os.path.join(folder, run) if folder else run, f"{run}.pex.run")
+    if not os.path.isfile(store_file):
+        return
+    store = RunStore(store_file)
+    missing = [tick for tick in ticks if tick <= store.ticks and not store.holds(tick)]
+    if missing:
+        stored = sorted(set(store.frames["tick"].tolist()))
+        raise click.ClickException(f"Run {run} does not store tick {missing[0]}, only tick(s) "
+                                   f"{', '.join(map(str, stored))}: run it out of core with --frame-every 1 to "
+                                   f"analyze every tick")
+
+
 def size_and_partitions(folder, influx, run, ticks):
+    # Number of nodes and of clusters at the last stored tick, from the run store without a graph.
     if influx:
-        g = None
-        t = ticks
-        while not g:
-            print(run, t)
-            g = network_from_influx(run, t)
-            t -= 1
+        load_influx_run(run, folder)
+    store_file = os.path.join(os.path.join(folder, run) if folder else run, f"{run}.pex.run")
+    overlay = None
+    if os.path.isfile(store_file):
+        store = RunStore(store_file)
+        overlay = store.overlay(min(ticks, store.ticks))
     else:
-        g = None
-        t = ticks
-        while not g:
-            g = network_from_files(run, t, folder)
-            t -= 1
-    n = g.number_of_nodes()
-    partitions_n = len(set(nx.get_node_attributes(g, "cluster").values()))
-    return n, 2
-
-
-def network_from_influx(run: str, tick: int) -> nx.DiGraph:
-    graph = nx.DiGraph()
-    client = InfluxDBClient(host="localhost", port=8086)
-    client.switch_database("testground")
-
-    max_tick = max(map(lambda t: int(t["value"]), client.query(
-        f'''SHOW TAG VALUES from "view" WITH key=tick WHERE run='{run}' ''').get_points()))
-    if max_tick < tick:
+        for tick in range(ticks, 0, -1):
+            overlay = overlay_from_files(run, tick, folder)
+            if overlay is not None:
+                break
+    if overlay is None:
+        raise click.ClickException(f"No overlay of run {run} up to tick {ticks}")
+    # The dead link plots read partition 1, so there are at least two.
+    return overlay.nodes, max(int(overlay.cluster.max(initial=0)) + 1, 2)
+
+
+def network_from_influx(run: str, tick: int, folder: str = None) -> nx.DiGraph:
+    load_influx_run(run, folder)
+    return network_from_files(run, tick, folder) or nx.DiGraph()
+
+
+def load_influx_run(run: str, folder: str, chunk_size: int = 10000) -> str:
+    # Reads the view points of a run once, in chunks, and caches them as a local run store, so
+    # every later analysis of the run reads files instead of querying InfluxDB.
+    run_folder = os.path.join(folder, run) if folder else run
+    store_file = os.path.join(run_folder, f"{run}.pex.run")
+    info_file = os.path.join(run_folder, "info.sim")
+    if os.path.isfile(store_file) and os.path.isfile(info_file):
+        return store_file
+
+    client = InfluxDBClient(host="localhost", port=8086, database="testground")
+    nodes_seq = {point["value"]: i for i, point in enumerate(client.query(
+        f'''SHOW TAG VALUES from "view" WITH key=node WHERE run='{run}' ''').get_points())}
+    views = {}
+    info = None
+    for chunk in client.query(f'''SELECT * FROM "view" WHERE run='{run}' ''', chunked=True,
+                              chunk_size=chunk_size):
+        for point in chunk.get_points():
+            tick = int(point["tick"])
+            if info is None and tick == 1:
+                info = {param: point[param] for param in ("C", "S", "R", "D")}
+            if not point["records"]:
+                continue
+            tick_views = views.setdefault(tick, {})
+            node = nodes_seq[point["node"]]
+            if node not in tick_views:
+                records = [nodes_seq[record] for record in point["records"].split("-") if record]
+                tick_views[node] = (int(point.get("cluster") or 0), records)
+
+    if not os.path.isdir(run_folder):
+        os.makedirs(run_folder)
+    c = max((len(records) for tick_views in views.values() for _, records in tick_views.values()), default=0)
+    write_store(store_file, len(nodes_seq), c, (overlay_from_views(len(nodes_seq), views.get(tick, {}))
+                                                for tick in range(1, max(views, default=0) + 1)))
+    with open(info_file, "w") as file:
+        for param, value in (info or {}).items():
+            file.write(f"{param}={value}\n")
+    return store_file
+
+
+def overlay_from_views(n: int, views: dict) -> "Overlay":
+    # Nodes without a point of their own in the tick are taken to be partitioned off.
+    cluster = np.ones(n, dtype=np.int32)
+    degree = np.zeros(n, dtype=np.int64)
+    for node, (node_cluster, records) in views.items():
+        cluster[node] = node_cluster
+        degree[node] = len(records)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(degree, out=indptr[1:])
+    indices = np.fromiter((record for node in sorted(views) for record in views[node][1]), dtype=np.int32,
+                          count=indptr[-1])
+    return Overlay(cluster, indptr, indices)
+
+
+METRIC_CACHE = "metrics.sqlite"
+
+
+class Overlay(NamedTuple):
+    # Views of one tick as CSR: the view of node i is indices[indptr[i]:indptr[i + 1]].
+    cluster: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+
+    @property
+    def nodes(self) -> int:
+        return len(self.cluster)
+
+    @staticmethod
+    def from_networkx(graph: nx.DiGraph):
+        n = graph.number_of_nodes()
+        cluster = np.array([int(graph.nodes[i].get("cluster", 0)) for i in range(n)], dtype=np.int32)
+        edges = np.array(sorted(graph.edges), dtype=np.int64).reshape(-1, 2)
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges[:, 0], minlength=n), out=indptr[1:])
+        return Overlay(cluster, indptr, edges[:, 1].astype(np.int32))
+
+    def to_networkx(self) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        graph.add_nodes_from((i, {"cluster": int(cluster)}) for i, cluster in enumerate(self.cluster))
+        src = np.repeat(np.arange(self.nodes), np.diff(self.indptr))
+        graph.add_edges_from(zip(src.tolist(), self.indices.tolist()))
         return graph
 
-    nodes = {}
-    nodes_seq = {}
-
-    for i, point in enumerate(client.query(
-            f'''SHOW TAG VALUES from "view" WITH key=node WHERE run='{run}' ''').get_points()):
-        nodes[i] = 0
-        nodes_seq[point["value"]] = i
-
-    # Extract node views at tick 'tick'
-    results = client.query(
-        f'''SELECT * FROM "view" WHERE run='{run}' AND tick='{tick}' ''')
-    found = set()
-    all_nodes = set()
-    for point in results.get_points():
-        if not point["records"]:
-            continue
-        node = point["node"]
-        node_seq = nodes_seq[node]
-        if node in found:
-            continue
+
+class RunStore:
+    # Reader for the run store written by simulator/store.py: keyframes plus an event log. Both
+    # are memory-mapped and only the frames of the ticks read are loaded. Stores in the views
+    # layout, the state files of out-of-core runs, hold the views of their last tick.
+    def __init__(self, path: str):
+        header, offset = read_header(path)
+        self.path = path
+        self.nodes = header["nodes"]
+        self.c = header["c"]
+        self.keyframes = header.get("keyframes", 1)
+        self.layout = header.get("layout", "csr")
+        if self.layout == "views":
+            dtype = views_frame_dtype(self.nodes, self.c)
+        else:
+            dtype = frame_dtype(self.nodes, header["capacity"], header.get("dtypes"))
+        self.frames = mapped(path, dtype, offset)
+        log_file = path[:-len("pex.run")] + "pex.log"
+        if self.keyframes > 1 and os.path.isfile(log_file):
+            self.events = mapped(log_file, EVENT_DTYPE)
+            self.ticks = int(self.events["tick"][-1]) if len(self.events) else 0
         else:
-            found.add(node)
+            self.events = np.zeros(0, dtype=EVENT_DTYPE)
+            self.ticks = len(self.frames)
+        if self.layout == "views":
+            # The live frame of the last tick, then copies of the views every few ticks, if any.
+            self.ticks = int(self.frames["tick"].max()) if len(self.frames) else 0
+
+    def overlay(self, tick: int) -> Overlay:
+        if not 1 <= tick <= self.ticks:
+            return None
+        if self.layout == "views":
+            return self.views_overlay(tick)
+        # Seek to the closest keyframe at or before the tick and replay the changes since then.
+        keyframe = (tick - 1) // self.keyframes
+        frame = self.frames[keyframe]
+        if "indptr" in frame.dtype.names:
+            indptr = frame["indptr"]
+        else:
+            indptr = np.zeros(self.nodes + 1, dtype=np.int64)
+            np.cumsum(frame["fill"], out=indptr[1:])
+        # The cluster and index arrays are the mapped frame itself, in the narrow types of the store.
+        overlay = Overlay(frame["cluster"], indptr, frame["indices"][:indptr[-1]])
+        first = keyframe * self.keyframes + 1
+        return self.replay(overlay, first + 1, tick) if tick > first else overlay
+
+    def holds(self, tick: int) -> bool:
+        if self.layout == "views":
+            return bool(np.any(self.frames["tick"] == tick))
+        return 1 <= tick <= self.ticks
+
+    def views_overlay(self, tick: int) -> Overlay:
+        stored = np.flatnonzero(self.frames["tick"] == tick)
+        if len(stored) == 0:
+            raise ValueError(f"{self.path} does not hold tick {tick}, only tick(s) "
+                             f"{', '.join(map(str, sorted(set(self.frames['tick'].tolist()))))}: out-of-core runs "
+                             f"keep their last tick and the ones of --frame-every only")
+        views = self.frames["nodes"][stored[0]]
+        fill = views["fill"]
+        indptr = np.zeros(self.nodes + 1, dtype=np.int64)
+        np.cumsum(fill, out=indptr[1:])
+        indices = views["peers"][np.arange(self.c) < fill[:, None]]
+        return Overlay(np.ascontiguousarray(views["cluster"]), indptr, indices)
+
+    def replay(self, overlay: Overlay, first: int, last: int) -> Overlay:
+        n = self.nodes
+        cluster = np.array(overlay.cluster)
+        edges = np.repeat(np.arange(n, dtype=np.int64), np.diff(overlay.indptr)) * n + overlay.indices
+        bounds = np.searchsorted(self.events["tick"], np.arange(first, last + 2))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            events = self.events[lo:hi]
+            op = events["op"]
+            keys = events["src"].astype(np.int64) * n + events["dst"]
+            edges = np.union1d(np.setdiff1d(edges, keys[op == Event.REMOVE]), keys[op == Event.ADD])
+            changed = op == Event.CLUSTER
+            cluster[events["src"][changed]] = events["dst"][changed]
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(edges // n, minlength=n), out=indptr[1:])
+        return Overlay(cluster, indptr, (edges % n).astype(np.int32))
+
+    def overlays(self, first: int, last: int) -> Iterator[Tuple[int, Overlay]]:
+        if self.layout == "views":
+            for tick in range(first, min(last, self.ticks) + 1):
+                yield tick, self.views_overlay(tick)
+            return
+        overlay = self.overlay(first)
+        if overlay is None:
+            return
+        yield first, overlay
+        for tick in range(first + 1, min(last, self.ticks) + 1):
+            if (tick - 1) % self.keyframes == 0:
+                overlay = self.overlay(tick)
+            else:
+                overlay = self.replay(overlay, tick, tick)
+            yield tick, overlay
+
+    def apply(self, graph: nx.DiGraph, tick: int):
+        lo, hi = np.searchsorted(self.events["tick"], [tick, tick + 1])
+        events = self.events[lo:hi]
+        for op in (Event.REMOVE, Event.ADD, Event.CLUSTER):
+            selected = events[events["op"] == op]
+            pairs = zip(selected["src"].tolist(), selected["dst"].tolist())
+            if op is Event.REMOVE:
+                graph.remove_edges_from(pairs)
+            elif op is Event.ADD:
+                graph.add_edges_from(pairs)
+            else:
+                nx.set_node_attributes(graph, dict(pairs), name="cluster")
+
+    def network(self, tick: int) -> nx.DiGraph:
+        overlay = self.overlay(tick)
+        return overlay.to_networkx() if overlay is not None else None
+
+    def stream(self, first: int, last: int) -> Iterator[Tuple[int, nx.DiGraph]]:
+        # Yields the same graph for every tick, updated in place.
+        if self.layout == "views":
+            for tick, overlay in self.overlays(first, last):
+                yield tick, overlay.to_networkx()
+            return
+        graph = self.network(first)
+        if graph is None:
+            return
+        yield first, graph
+        for tick in range(first + 1, min(last, self.ticks) + 1):
+            if self.keyframes > 1:
+                self.apply(graph, tick)
+            else:
+                graph = self.network(tick)
+            yield tick, graph
+
+
+class PathLengths(NamedTuple):
+    # Average over the reachable ordered pairs, with a 95% confidence interval when only part of
+    # the nodes were used as BFS sources, and the fraction of ordered pairs that are reachable.
+    mean: float
+    low: float
+    high: float
+    reachable: float
+    sources: int
+    diameter: int
+    per_source: List[float]
+    histogram: List[int]
+
+
+def reverse_edges(overlay: Overlay) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Incoming edges grouped by target: the nodes with any, where each group starts, the sources.
+    src = np.repeat(np.arange(overlay.nodes), np.diff(overlay.indptr))
+    order = np.argsort(overlay.indices, kind="stable")
+    targets, starts = np.unique(overlay.indices[order], return_index=True)
+    return targets, starts, src[order]
+
 
-        records = point["records"].split("-")
+def bfs_block(overlay: Overlay, reverse: Tuple[np.ndarray, np.ndarray, np.ndarray],
+              sources: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Up to 64 BFS at once: bit b of a node's word is set once sources[b] reached it. Returns the
+    # distance sum, reached nodes and eccentricity of every source and the distance histogram.
+    targets, starts, src = reverse
+    k = len(sources)
+    visited = np.zeros(overlay.nodes, dtype=np.uint64)
+    visited[sources] = np.left_shift(np.uint64(1), np.arange(k, dtype=np.uint64))
+    frontier = visited.copy()
+    totals = np.zeros(k, dtype=np.int64)
+    counts = np.zeros(k, dtype=np.int64)
+    eccentricity = np.zeros(k, dtype=np.int64)
+    histogram = [0]
+    depth = 0
+    while True:
+        depth += 1
+        reached = np.zeros_like(visited)
+        if len(src):
+            reached[targets] = np.bitwise_or.reduceat(frontier[src], starts)
+        reached &= ~visited
+        changed = np.flatnonzero(reached)
+        if not len(changed):
+            break
+        visited[changed] |= reached[changed]
+        frontier = reached
+        bits = np.unpackbits(reached[changed].view(np.uint8), bitorder="little").reshape(-1, 64)
+        found = bits[:, :k].sum(axis=0, dtype=np.int64)
+        totals += depth * found
+        counts += found
+        eccentricity[found > 0] = depth
+        histogram.append(int(found.sum()))
+    return totals, counts, eccentricity, np.array(histogram, dtype=np.int64)
 
-        for record in records:
-            if record:
-                graph.add_edge(node_seq, nodes_seq[record])
-                all_nodes.add(record)
-        nx.set_node_attributes(graph, {node_seq: point.get("cluster", 0)}, name="cluster")
-    for node in all_nodes - found:
-        nx.set_node_attributes(graph, {nodes_seq[node]: 1}, name="cluster")
 
-    return graph
+_graph = None
+
+
+def _share_graph(overlay: Overlay, reverse: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+    global _graph
+    _graph = (overlay, reverse)
+
+
+def _bfs_block(sources: np.ndarray):
+    return bfs_block(*_graph, sources)
+
+
+def source_blocks(overlay: Overlay, blocks: Iterator[np.ndarray], jobs: int = 1):
+    # Streams the results of the source blocks in order; with jobs > 1 each worker receives the
+    # graph once and at most two blocks per worker are in flight.
+    reverse = reverse_edges(overlay)
+    if jobs <= 1:
+        for block in blocks:
+            yield bfs_block(overlay, reverse, block)
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_share_graph, initargs=(overlay, reverse)) as executor:
+        pending = deque()
+        try:
+            for block in blocks:
+                pending.append(executor.submit(_bfs_block, block))
+                if len(pending) >= 2 * jobs:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def path_lengths(overlay: Overlay, sources: int = None, error: float = None, seed: int = 0,
+                 jobs: int = 1) -> PathLengths:
+    # BFS from uniformly sampled sources, 64 at a time: a fixed number of them, or blocks of them
+    # until the confidence interval is within `error` of the mean. All nodes as sources gives the
+    # exact values, without ever holding more than one block of distances.
+    n = overlay.nodes
+    order = np.random.default_rng(seed).permutation(n)
+    limit = n if sources is None else min(sources, n)
+    blocks = (order[start:min(start + 64, limit)] for start in range(0, limit, 64))
+    totals, counts, eccentricity = [], [], []
+    histogram = np.zeros(1, dtype=np.int64)
+    estimate = (float("nan"),) * 3
+    for block_totals, block_counts, block_eccentricity, block_histogram in source_blocks(overlay, blocks, jobs):
+        totals.extend(block_totals.tolist())
+        counts.extend(block_counts.tolist())
+        eccentricity.extend(block_eccentricity.tolist())
+        histogram = np.pad(histogram, (0, max(len(block_histogram) - len(histogram), 0)))
+        histogram[:len(block_histogram)] += block_histogram
+        estimate = ratio_estimate(np.array(totals, dtype=np.float64), np.array(counts, dtype=np.float64), n)
+        if error is not None and estimate[0] and (estimate[2] - estimate[1]) / 2 <= error * estimate[0]:
+            break
+    mean, low, high = estimate
+    counts = np.array(counts)
+    per_source = np.divide(totals, counts, out=np.zeros(len(counts)), where=counts > 0)
+    return PathLengths(mean, low, high, counts.sum() / (max(len(counts), 1) * max(n - 1, 1)), len(counts),
+                       max(eccentricity, default=0), per_source.tolist(), histogram[1:].tolist())
+
+
+def ratio_estimate(totals: np.ndarray, counts: np.ndarray, n: int) -> Tuple[float, float, float]:
+    # Ratio estimator of the mean distance over reachable pairs, with a finite population correction.
+    k = len(totals)
+    if not counts.sum():
+        return float("nan"), float("nan"), float("nan")
+    mean = totals.sum() / counts.sum()
+    if k < 2:
+        return mean, float("-inf"), float("inf")
+    residuals = totals - mean * counts
+    variance = residuals.var(ddof=1) / (k * counts.mean() ** 2) * (1 - k / n)
+    half = 1.96 * np.sqrt(variance)
+    return float(mean), float(mean - half), float(mean + half)
+
+
+def write_store(path: str, nodes: int, c: int, overlays: Iterator["Overlay"]):
+    # A full frame for every tick, swapped in once complete.
+    with RunWriter(path + ".tmp", nodes, c) as writer:
+        for tick, overlay in enumerate(overlays, start=1):
+            writer.write(tick, overlay)
+    os.replace(path + ".tmp", path)
+
+
+def mapped(path: str, dtype: np.dtype, offset: int = 0) -> np.ndarray:
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+
+
+def overlay_from_files(run: str, tick: int, folder: str) -> Overlay:
+    store_file = os.path.join(os.path.join(folder, run) if folder else run, f"{run}.pex.run")
+    if os.path.isfile(store_file):
+        return RunStore(store_file).overlay(tick)
+    graph = network_from_files(run, tick, folder)
+    return Overlay.from_networkx(graph) if graph is not None else None
 
 
 def network_from_files(run: str, tick: int, folder: str) -> nx.DiGraph:
     folder = os.path.join(folder, run) if folder else run
+    store_file = os.path.join(folder, f"{run}.pex.run")
+    if os.path.isfile(store_file):
+        return RunStore(store_file).network(tick)
+    # Runs recorded before the run store have one gpickle per tick.
     input_file = os.path.join(folder, f"{run}.{tick}.partition.sim")
     if os.path.isfile(input_file):
         return nx.read_gpickle(input_file)
     return None
 
 
+def networks_from_files(run: str, ticks: int, folder: str) -> Iterator[Tuple[int, nx.DiGraph]]:
+    store_file = os.path.join(os.path.join(folder, run) if folder else run, f"{run}.pex.run")
+    if os.path.isfile(store_file):
+        yield from RunStore(store_file).stream(1, ticks)
+        return
+    for tick in range(1, ticks + 1):
+        yield tick, network_from_files(run, tick, folder)
+
+
+def overlays_from_files(run: str, ticks: int, folder: str) -> Iterator[Tuple[int, Overlay]]:
+    store_file = os.path.join(os.path.join(folder, run) if folder else run, f"{run}.pex.run")
+    if os.path.isfile(store_file):
+        yield from RunStore(store_file).overlays(1, ticks)
+        return
+    for tick in range(1, ticks + 1):
+        yield tick, overlay_from_files(run, tick, folder)
+
+
+class MetricCache:
+    # Metric values of a run, stored next to it and keyed by tick, metric name, parameters and a
+    # hash of the tick's overlay. Opening the cache drops every entry when the files of the run
+    # changed since the last time, unless it was already settled; closing it evicts the least
+    # recently used entries beyond max_bytes. Every write is committed at once, so that concurrent
+    # workers only hold the write lock for one statement.
+    def __init__(self, run: str, folder: str, max_bytes: int = 64 << 20, settled: bool = False):
+        self.run = run
+        self.folder = os.path.join(folder, run) if folder else run
+        self.max_bytes = max_bytes
+        self._digests = {}
+        os.makedirs(self.folder, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(self.folder, METRIC_CACHE), timeout=60)
+        # Readers do not block on the writer in the write-ahead log mode.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS metrics "
+                        "(key TEXT PRIMARY KEY, tick INTEGER, metric TEXT, value TEXT, size INTEGER, used REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS run (fingerprint TEXT)")
+        self.db.commit()
+        if not settled:
+            fingerprint = self.fingerprint()
+            if self.db.execute("SELECT fingerprint FROM run").fetchone() != (fingerprint,):
+                self.db.execute("DELETE FROM metrics")
+                self.db.execute("DELETE FROM run")
+                self.db.execute("INSERT INTO run VALUES (?)", (fingerprint,))
+            self.db.commit()
+
+    def fingerprint(self) -> str:
+        files = sorted(name for name in os.listdir(self.folder) if not name.startswith(METRIC_CACHE))
+        stats = [(name, os.stat(os.path.join(self.folder, name))) for name in files]
+        return hashlib.sha1(repr([(name, st.st_size, st.st_mtime_ns) for name, st in stats]).encode()).hexdigest()
+
+    def digest(self, tick: int, overlay: Overlay) -> str:
+        if tick not in self._digests:
+            digest = hashlib.sha1()
+            for array in overlay:
+                digest.update(np.ascontiguousarray(array).data)
+            self._digests[tick] = digest.hexdigest()
+        return self._digests[tick]
+
+    def metric(self, tick: int, overlay: Overlay, name: str, compute: Callable[[], object], **params):
+        key = hashlib.sha1(json.dumps([self.run, tick, name, params, self.digest(tick, overlay)],
+                                      sort_keys=True).encode()).hexdigest()
+        row = self.db.execute("SELECT value FROM metrics WHERE key = ?", (key,)).fetchone()
+        if row:
+            self.db.execute("UPDATE metrics SET used = ? WHERE key = ?", (time.time(), key))
+            self.db.commit()
+            return json.loads(row[0])
+        value = compute()
+        encoded = json.dumps(value)
+        self.db.execute("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, tick, name, encoded, len(encoded), time.time()))
+        self.db.commit()
+        return value
+
+    def close(self, evict: bool = True):
+        if evict:
+            total = 0
+            evicted = []
+            for key, size in self.db.execute("SELECT key, size FROM metrics ORDER BY used DESC"):
+                total += size
+                if total > self.max_bytes:
+                    evicted.append((key,))
+            self.db.executemany("DELETE FROM metrics WHERE key = ?", evicted)
+            self.db.commit()
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def info_from_files(run: str, folder: str):
     folder = os.path.join(folder, run) if folder else run
     input_file = os.path.join(folder, "info.sim")
     if os.path.isfile(input_file):
         with open(input_file) as file:
-            params = ", ".join(file.read().splitlines())
+            params = ", ".join(line for line in file.read().splitlines()
+                               if line.split("=")[0] not in ("seed", "repetition"))
             # params = dict(tuple(line.split("=")) for line in file.readlines())
             return params
     return None
 
 
 def info_from_influx(run: str, folder: str):
-    client = InfluxDBClient(host="localhost", port=8086)
-    client.switch_database("testground")
-    results = client.query(f'''SELECT * FROM "view" WHERE run='{run}' ''')
-    point = next(results.get_points(tags={"tick": str(1)}))
-    return f"C={point['C']}, S={point['S']}, R={point['R']}, D={point['D']},"
+    load_influx_run(run, folder)
+    return info_from_files(run, folder)
 
 
 cli = click.CommandCollection(sources=[cli1, cli2, cli3])
@@ -0,0 +1,55 @@
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+from pex import MetricCache, Overlay, run_metrics, write_store
+
+
+def overlay(tick: int, nodes: int = 30, c: int = 3) -> Overlay:
+    rng = np.random.default_rng(tick)
+    indices = np.concatenate([rng.choice(np.delete(np.arange(nodes), i), c, replace=False) for i in range(nodes)])
+    return Overlay(np.zeros(nodes, dtype=np.int32), np.arange(0, nodes * c + 1, c, dtype=np.int64),
+                   indices.astype(np.int32))
+
+
+def write_metrics(run: str, folder: str, worker: int, barrier):
+    cache = MetricCache(run, folder, settled=True)
+    for tick in range(1, 21):
+        cache.metric(tick, overlay(tick), f"metric{worker}", lambda: [worker, tick])
+    # Every worker keeps its connection open until all of them wrote their values.
+    barrier.wait(timeout=30)
+    cache.close(evict=False)
+
+
+def test_concurrent_writers(tmp_path):
+    folder = str(tmp_path)
+    MetricCache("run", folder).close()
+    barrier = multiprocessing.Barrier(4)
+    workers = [multiprocessing.Process(target=write_metrics, args=("run", folder, worker, barrier))
+               for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+    with MetricCache("run", folder) as cache:
+        for worker in range(4):
+            for tick in range(1, 21):
+                assert cache.metric(tick, overlay(tick), f"metric{worker}", lambda: None) == [worker, tick]
+
+
+def test_run_metrics_jobs(tmp_path):
+    folder = str(tmp_path)
+    os.makedirs(os.path.join(folder, "run"))
+    write_store(os.path.join(folder, "run", "run.pex.run"), 30, 3, (overlay(tick) for tick in range(1, 7)))
+    metrics = ["degree", "indegree", "average_clustering", "path_lengths", "dead_links"]
+    # Cached values come back as JSON.
+    sequential = json.loads(json.dumps(run_metrics(["run"], 6, folder, metrics, [2], 1)))
+    assert len(sequential[0]) == 6
+    assert run_metrics(["run"], 6, folder, metrics, [2], 2) == sequential
+    for name in os.listdir(os.path.join(folder, "run")):
+        if name.startswith("metrics.sqlite"):
+            os.remove(os.path.join(folder, "run", name))
+    assert json.loads(json.dumps(run_metrics(["run"], 6, folder, metrics, [2], 2))) == sequential
@@ -0,0 +1,84 @@
+from typing import List
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from pex import (Overlay, average_clustering, clustering, dead_links, eviction_curve, partition_resistance,
+                 path_lengths)
+
+
+def random_overlay(nodes: int = 80, c: int = 5, seed: int = 0) -> Overlay:
+    rng = np.random.default_rng(seed)
+    graph = nx.gnm_random_graph(nodes, nodes * c, directed=True, seed=seed)
+    nx.set_node_attributes(graph, {i: int(rng.random() < 0.3) for i in graph}, name="cluster")
+    return Overlay.from_networkx(graph)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_clustering(seed):
+    overlay = random_overlay(seed=seed)
+    graph = overlay.to_networkx()
+    expected = nx.clustering(graph)
+    assert clustering(overlay) == pytest.approx([expected[i] for i in range(overlay.nodes)])
+    assert clustering(overlay, chunk_size=7) == pytest.approx([expected[i] for i in range(overlay.nodes)])
+    assert average_clustering(overlay) == pytest.approx(nx.average_clustering(graph))
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_path_lengths(seed):
+    overlay = random_overlay(nodes=60, c=2, seed=seed)
+    graph = overlay.to_networkx()
+    lengths = [d for _, targets in nx.shortest_path_length(graph) for d in targets.values() if d > 0]
+    path = path_lengths(overlay)
+    assert path.mean == pytest.approx(np.mean(lengths))
+    assert path.reachable == pytest.approx(len(lengths) / (60 * 59))
+    assert path.diameter == max(lengths)
+    assert path.histogram == np.bincount(lengths)[1:].tolist()
+
+
+def test_dead_links():
+    overlay = random_overlay()
+    graph = overlay.to_networkx()
+    expected = sum(1 for u, v in graph.edges if graph.nodes[u]["cluster"] == 0 and graph.nodes[v]["cluster"] == 1)
+    assert dead_links(overlay, 2) == ([0, expected], int(np.count_nonzero(overlay.cluster == 0)))
+
+
+def brute_force_eviction(graph: nx.Graph, order: np.ndarray) -> List[float]:
+    # Evicts the first 1..99% of `order` from a copy of the graph and measures its components.
+    curve = []
+    for p in range(1, 100):
+        evicted = int(graph.number_of_nodes() * (p / 100))
+        left = graph.subgraph(order[evicted:].tolist())
+        largest = max(map(len, nx.connected_components(left)), default=0)
+        curve.append((left.number_of_nodes() - largest) / graph.number_of_nodes())
+    return curve
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_partition_resistance(seed):
+    # Sparse enough that evictions split the overlay into many components.
+    overlay = random_overlay(nodes=50, c=1, seed=seed)
+    graph = overlay.to_networkx().to_undirected()
+    resistance = partition_resistance(overlay, 3, seed=seed)
+    assert len(resistance["mean"]) == 99
+    assert all(low <= mean <= high and 0 <= mean <= 1 for low, mean, high in
+               zip(resistance["low"], resistance["mean"], resistance["high"]))
+    src = np.repeat(np.arange(overlay.nodes), np.diff(overlay.indptr))
+    edges = np.stack((src, overlay.indices))
+    curves = []
+    for s in np.random.SeedSequence(seed).spawn(3):
+        # eviction_curve evicts in the order of the permutation drawn from its seed.
+        curves.append(brute_force_eviction(graph, np.random.default_rng(s).permutation(overlay.nodes)))
+        assert eviction_curve(overlay.nodes, edges, s) == pytest.approx(curves[-1])
+    assert resistance["mean"] == pytest.approx(np.mean(curves, axis=0).tolist())
+
+@pytest.mark.parametrize("dtype", [np.uint16, np.uint32])
+def test_narrow_overlay(dtype):
+    # Run stores hand out their cluster and index arrays in the narrow types they are stored in.
+    overlay = random_overlay()
+    narrow = Overlay(overlay.cluster.astype(np.uint16), overlay.indptr, overlay.indices.astype(dtype))
+    assert clustering(narrow) == pytest.approx(clustering(overlay))
+    assert path_lengths(narrow) == path_lengths(overlay)
+    assert dead_links(narrow, 2) == dead_links(overlay, 2)
+    assert partition_resistance(narrow, 3, seed=0) == partition_resistance(overlay, 3, seed=0)
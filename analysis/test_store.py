@@ -0,0 +1,154 @@
+import os
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from pex import RunStore, check_ticks, cli
+# The run store format is the simulator's, as pex imports it.
+from store import RunWriter, copy_run, frame_dtype, views_frame_dtype, write_header
+
+
+def snapshots(nodes: int, c: int, ticks: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    for tick in range(1, ticks + 1):
+        fill = rng.integers(0, c + 1, nodes)
+        indptr = np.zeros(nodes + 1, dtype=np.int64)
+        np.cumsum(fill, out=indptr[1:])
+        # Distinct offsets from the node itself, so views hold neither the node nor duplicates.
+        offsets = rng.choice(np.arange(1, nodes), c, replace=False)
+        column = np.arange(indptr[-1]) - np.repeat(indptr[:-1], fill)
+        indices = ((np.repeat(np.arange(nodes), fill) + offsets[column]) % nodes).astype(np.int32)
+        cluster = (rng.random(nodes) < tick / (2 * ticks)).astype(np.int32)
+        yield tick, (cluster, indptr, indices)
+
+
+def assert_same(overlay, snapshot):
+    cluster, indptr, indices = snapshot
+    assert np.array_equal(overlay.cluster, cluster)
+    assert np.array_equal(overlay.indptr, indptr)
+    # Replayed ticks come back with every view sorted.
+    for i in range(len(cluster)):
+        assert np.array_equal(np.sort(overlay.indices[overlay.indptr[i]:overlay.indptr[i + 1]]),
+                              np.sort(indices[indptr[i]:indptr[i + 1]]))
+
+
+@pytest.mark.parametrize("nodes,c,keyframes", [(50, 6, 1), (50, 6, 3), (70000, 2, 1), (400, 300, 1)])
+def test_round_trip(tmp_path, nodes, c, keyframes):
+    path = str(tmp_path / "run.pex.run")
+    written = list(snapshots(nodes, c, 7 if nodes < 1000 else 2))
+    with RunWriter(path, nodes, c, keyframes) as writer:
+        for tick, snapshot in written:
+            writer.write(tick, snapshot)
+    store = RunStore(path)
+    assert store.ticks == len(written)
+    for tick, snapshot in written:
+        assert_same(store.overlay(tick), snapshot)
+    for (tick, overlay), (written_tick, snapshot) in zip(store.overlays(1, len(written)), written):
+        assert tick == written_tick
+        assert_same(overlay, snapshot)
+
+
+def test_narrow_frames(tmp_path):
+    path = str(tmp_path / "run.pex.run")
+    with RunWriter(path, 1000, 32) as writer:
+        for tick, snapshot in snapshots(1000, 32, 1):
+            writer.write(tick, snapshot)
+    store = RunStore(path)
+    # Two bytes per record, two per cluster and one per view size.
+    assert store.frames.dtype.itemsize == 4 + 1000 * (2 + 1 + 2 * 32)
+    # Overlays of keyframes are views of the mapped frames, not copies.
+    overlay = store.overlay(1)
+    assert overlay.indices.dtype == np.uint16 and overlay.cluster.dtype == np.uint16
+    assert np.shares_memory(overlay.indices, store.frames) and np.shares_memory(overlay.cluster, store.frames)
+
+
+def test_resume(tmp_path):
+    path, copy = str(tmp_path / "run.pex.run"), str(tmp_path / "copy.pex.run")
+    written = list(snapshots(40, 5, 8))
+    with RunWriter(path, 40, 5, 3) as writer:
+        for tick, snapshot in written:
+            writer.write(tick, snapshot)
+    copy_run(path, copy, 4)
+    with RunWriter(copy, 40, 5, 3, append=True) as writer:
+        writer.resume(written[3][1])
+        for tick, snapshot in written[4:]:
+            writer.write(tick, snapshot)
+    for name in (".pex.run", ".pex.log"):
+        with open(str(tmp_path / ("run" + name)), "rb") as a, open(str(tmp_path / ("copy" + name)), "rb") as b:
+            assert a.read() == b.read()
+
+
+def test_unsized_frames(tmp_path):
+    # Stores written before the narrow frames hold int32 clusters and indices and an int64 indptr.
+    path = str(tmp_path / "run.pex.run")
+    written = list(snapshots(30, 4, 3))
+    dtype = frame_dtype(30, 120)
+    with open(path, "wb") as file:
+        write_header(file, {"nodes": 30, "c": 4, "capacity": 120, "keyframes": 1})
+        for tick, (cluster, indptr, indices) in written:
+            frame = np.zeros(1, dtype=dtype)
+            frame["tick"], frame["cluster"], frame["indptr"] = tick, cluster, indptr
+            frame["indices"][0, :len(indices)] = indices
+            file.write(frame.tobytes())
+    store = RunStore(path)
+    for tick, snapshot in written:
+        assert_same(store.overlay(tick), snapshot)
+    with RunWriter(path, 30, 4, append=True) as writer:
+        writer.write(4, written[0][1])
+    assert_same(RunStore(path).overlay(4), written[0][1])
+
+
+def write_views(path: str, ticks):
+    # Out-of-core runs: the live frame of the last tick, then the copies of --frame-every.
+    dtype = views_frame_dtype(20, 4)
+    with open(path, "wb") as file:
+        write_header(file, {"nodes": 20, "c": 4, "keyframes": 1, "layout": "views"})
+        for tick in ticks:
+            frame = np.zeros(1, dtype=dtype)
+            views = frame["nodes"][0]
+            views["fill"] = 2
+            views["peers"][:, :2] = (np.arange(20)[:, None] + [1, tick]) % 20
+            views["cluster"][10:] = 1
+            frame["tick"] = tick
+            file.write(frame.tobytes())
+
+
+def test_views_layout(tmp_path):
+    path = str(tmp_path / "run" / "run.pex.run")
+    os.makedirs(os.path.dirname(path))
+    write_views(path, [5])
+    store = RunStore(path)
+    assert store.ticks == 5
+    overlay = store.overlay(5)
+    assert np.array_equal(overlay.indptr, np.arange(0, 41, 2))
+    assert np.array_equal(overlay.indices, ((np.arange(20)[:, None] + [1, 5]) % 20).ravel())
+    assert np.array_equal(overlay.cluster, np.repeat([0, 1], 10))
+    with pytest.raises(ValueError, match="does not hold tick 4"):
+        store.overlay(4)
+    with pytest.raises(ValueError, match="does not hold tick 1"):
+        list(store.overlays(1, 5))
+    result = CliRunner().invoke(cli, ["dynamic", "run", "-t", "5", "--folder", str(tmp_path)])
+    assert result.exit_code == 1
+    assert "Run run does not store tick 1, only tick(s) 5" in result.output
+
+
+def test_views_frames(tmp_path):
+    path = str(tmp_path / "run" / "run.pex.run")
+    os.makedirs(os.path.dirname(path))
+    write_views(path, [4, 1, 2, 3, 4])
+    store = RunStore(path)
+    assert store.ticks == 4
+    assert [tick for tick, _ in store.overlays(1, 9)] == [1, 2, 3, 4]
+    for tick in range(1, 5):
+        assert np.array_equal(store.overlay(tick).indices, ((np.arange(20)[:, None] + [1, tick]) % 20).ravel())
+    check_ticks("run", str(tmp_path), range(1, 10))
+
+
+def test_oversized_views(tmp_path):
+    # View sizes of stores with c < 256 take one byte each.
+    cluster, indptr = np.zeros(100, dtype=np.int32), np.zeros(101, dtype=np.int64)
+    indptr[1:] = 300
+    with RunWriter(str(tmp_path / "run.pex.run"), 100, 4) as writer:
+        with pytest.raises(ValueError, match="views of more than 255 records"):
+            writer.write(1, (cluster, indptr, np.arange(300, dtype=np.int32) % 100))
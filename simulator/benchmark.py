@@ -0,0 +1,115 @@
+import os
+import random
+import time
+import timeit
+from typing import List
+
+import click
+import numpy as np
+
+import pex
+from pex import Engine, new_cluster
+from scheduler import EventScheduler
+from topology import Topology, Views, build_views
+
+
+def time_ticks(engine: Engine, nodes_amount: int, c: int, ticks: int, seed: int, workers: int = 1,
+               batched: bool = False) -> float:
+    rng = np.random.default_rng(seed)
+    cluster = new_cluster(engine, nodes_amount, 1, c, 0, 0, 0.5, False, batched, rng=rng, workers=workers)
+    cluster.initialize_overlay(build_views(Topology.RAND, nodes_amount, 4, 0.1, rng))
+    cluster.simulate_tick(1)
+    started = time.perf_counter()
+    for tick in range(2, ticks + 2):
+        cluster.simulate_tick(tick)
+    elapsed = time.perf_counter() - started
+    if engine is Engine.SHARDED:
+        cluster.close()
+    return elapsed / ticks
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("-n", "--nodes-amount", type=int, default=100000)
+@click.option("-c", type=int, default=32)
+@click.option("-t", "--ticks", type=int, default=3)
+@click.option("-w", "--workers", multiple=True, type=int, default=[1, 2, 4, 8, 16])
+@click.option("--seed", type=int, default=0)
+def sharded(nodes_amount: int, c: int, ticks: int, workers: List[int], seed: int):
+    # The first tick starts the workers and is not timed.
+    print(f"N={nodes_amount}, c={c}, {os.cpu_count()} cores")
+    batched = time_ticks(Engine.ARRAY, nodes_amount, c, ticks, seed, batched=True)
+    print(f"array engine, batched: {batched:.2f} s/tick")
+    base = None
+    for w in workers:
+        seconds = time_ticks(Engine.SHARDED, nodes_amount, c, ticks, seed, w)
+        base = base or seconds * w
+        print(f"sharded, {w} workers: {seconds:.2f} s/tick, speedup {batched / seconds:.2f}x over batched ticks, "
+              f"parallel efficiency {base / (seconds * w):.0%}")
+
+
+@cli.command()
+@click.option("-c", multiple=True, type=int, default=[8, 32, 128, 512])
+@click.option("-e", "--exchanges", type=int, default=2000)
+def aging(c: List[int], exchanges: int):
+    # Aging a view used to increment the hop of every record at the end of each pull; now it
+    # is a single increment of the node's age. Exchanges are timed with P = c / 4.
+    for size in c:
+        n = 4 * size
+        cluster = new_cluster(Engine.OBJECT, n, 1, size, 0, size // 4, 0.5, False)
+        peers = (np.arange(n)[:, None] + np.arange(1, size + 1)) % n
+        cluster.initialize_overlay(Views(np.arange(0, n * size + 1, size), peers.ravel()))
+        node = pex.nodes[0]
+        eager = timeit.timeit(lambda: [setattr(r, "hop", r.hop + 1) for r in node.neighbors], number=exchanges)
+
+        def advance():
+            node.age += 1
+
+        lazy = timeit.timeit(advance, number=exchanges)
+        pairs = [tuple(random.sample(range(n), 2)) for _ in range(exchanges)]
+        started = time.perf_counter()
+        for a, b in pairs:
+            pushed, pushed_back = cluster.send(a, b), cluster.send(b, a)
+            cluster.receive(a, b, pushed_back)
+            cluster.receive(b, a, pushed)
+        exchange = (time.perf_counter() - started) / exchanges
+        print(f"c={size}: aging per pull {eager / exchanges * 1e6:.2f} us eager, "
+              f"{lazy / exchanges * 1e6:.3f} us lazy; push-pull exchange {exchange * 1e6:.1f} us")
+
+
+@cli.command()
+@click.option("-n", "--nodes-amount", type=int, default=20000)
+@click.option("-c", type=int, default=32)
+@click.option("-t", "--ticks", type=int, default=3)
+@click.option("-e", "--engine", "engines", multiple=True, type=click.Choice(["object", "array"]),
+              default=["object", "array"])
+@click.option("--latency", type=float, default=0.05)
+@click.option("--seed", type=int, default=0)
+def events(nodes_amount: int, c: int, ticks: int, engines: List[str], latency: float, seed: int):
+    # Asynchronous runs cost per event: a timer, a request and a response per exchange. The
+    # first tick is not timed.
+    print(f"N={nodes_amount}, c={c}, latency {latency}")
+    for name in engines:
+        engine = Engine.from_string(name)
+        random.seed(seed)
+        np.random.seed(seed)
+        rng = np.random.default_rng(seed)
+        cluster = new_cluster(engine, nodes_amount, 1, c, 0, 0, 0.5, False, rng=rng)
+        cluster.initialize_overlay(build_views(Topology.RAND, nodes_amount, 4, 0.1, rng))
+        scheduler = EventScheduler(cluster, latency=latency, rng=rng)
+        scheduler.simulate_tick(1)
+        handled = scheduler.events
+        started = time.perf_counter()
+        for tick in range(2, ticks + 2):
+            scheduler.simulate_tick(tick)
+        elapsed = time.perf_counter() - started
+        print(f"{name} engine: {(scheduler.events - handled) / elapsed:,.0f} events/s, "
+              f"{elapsed / ticks:.2f} s/tick")
+
+
+if __name__ == '__main__':
+    cli()
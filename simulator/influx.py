@@ -0,0 +1,103 @@
+import queue
+import threading
+import time
+from typing import Iterable, List, Tuple
+
+from influxdb import InfluxDBClient
+
+MEASUREMENT = "diagnostics.casm-pex-convergence.view.point"
+_FLUSH = object()
+
+
+def escape_tag(value) -> str:
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def view_lines(views: Iterable[Tuple[int, List[int], int]], run_id: str, tick: int, timestamp: int) -> List[str]:
+    # Line protocol with the tags in key order; an empty view has no records tag.
+    suffix = f"run={escape_tag(run_id)},tick={tick} value=0.0 {timestamp}"
+    lines = []
+    for index, records, cluster_id in views:
+        if records:
+            lines.append(f"{MEASUREMENT},cluster={cluster_id},node={index},"
+                         f"records={'-'.join(map(str, records))},{suffix}")
+        else:
+            lines.append(f"{MEASUREMENT},cluster={cluster_id},node={index},{suffix}")
+    return lines
+
+
+class InfluxWriter:
+    # Sends line protocol from a background thread over a single client session. Points are
+    # batched across ticks and flushed when a batch is full or older than `flush_interval`;
+    # the queue is bounded, so a slow server blocks the simulation instead of growing memory.
+    def __init__(self, host: str = "localhost", port: int = 8086, database: str = "testground",
+                 batch_size: int = 5000, flush_interval: float = 1.0, max_batches: int = 8):
+        self.client = InfluxDBClient(host=host, port=port, database=database)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.points = 0
+        self.sending = 0.0
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write_views(self, views: Iterable[Tuple[int, List[int], int]], run_id: str, tick: int):
+        self.write(view_lines(views, run_id, tick, int(time.time())))
+
+    def write(self, lines: List[str]):
+        self._raise()
+        for start in range(0, len(lines), self.batch_size):
+            self._queue.put(lines[start:start + self.batch_size])
+
+    def flush(self):
+        self._queue.put(_FLUSH)
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._raise()
+
+    @property
+    def rate(self) -> float:
+        return self.points / self.sending if self.sending else 0.0
+
+    def _run(self):
+        buffer = []
+        taken = 0
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                lines = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                taken += 1
+            except queue.Empty:
+                lines = []
+            if isinstance(lines, list):
+                buffer.extend(lines)
+            if not isinstance(lines, list) or len(buffer) >= self.batch_size or time.monotonic() >= deadline:
+                self._send(buffer)
+                buffer = []
+                deadline = time.monotonic() + self.flush_interval
+                # Batches only count as done once they have been sent, so flush() waits for them.
+                for _ in range(taken):
+                    self._queue.task_done()
+                taken = 0
+            if lines is None:
+                return
+
+    def _send(self, buffer: List[str]):
+        if not buffer or self._error:
+            return
+        started = time.perf_counter()
+        try:
+            self.client.write_points(buffer, time_precision="s", protocol="line")
+            self.points += len(buffer)
+            self.sending += time.perf_counter() - started
+        except Exception as e:
+            self._error = e
+
+    def _raise(self):
+        if self._error:
+            raise RuntimeError("Writing to InfluxDB failed") from self._error
@@ -0,0 +1,112 @@
+import mmap
+import os
+
+import numpy as np
+
+from engine import ArrayCluster, ViewState
+from store import views_frame_dtype, write_header
+from topology import Views, cap_views
+
+# Out-of-core runs: the views live in a memory-mapped run store in the views layout, a single
+# frame rewritten in place every tick, so the store of the run is the state itself. Every
+# `frame_every` ticks a copy of that frame is appended to the store, block by block, so that the
+# views of earlier ticks can be analyzed without ever holding a whole tick in memory. Ticks are
+# batched ticks over chunks of node indices: a chunk's initiators pick their partners from the
+# views as the previous chunks left them. The pages a chunk touched are dropped from the process
+# after it, so the resident memory is bounded by the chunk instead of the number of nodes.
+
+# Resident memory of a chunk, measured: batched exchanges take up to 107 bytes of temporaries per
+# record of view capacity and participant, and reading the view of a random partner maps about
+# 64 KiB of the file, as the kernel maps the cached pages around a faulting one as well.
+_BYTES_PER_RECORD = 128
+_BYTES_PER_PARTNER = 64 * 2 ** 10
+
+
+def chunk_size(memory_budget: int, c: int, fanout: int) -> int:
+    per_initiator = _BYTES_PER_RECORD * c * (1 + fanout) + _BYTES_PER_PARTNER * fanout
+    return max(memory_budget * 2 ** 20 // per_initiator, 1)
+
+
+class MappedViewState(ViewState):
+    FIELDS = ("cluster", "fill", "peers", "hops")
+
+    def __init__(self, path: str, nodes_amount: int, c: int):
+        self.path = path
+        self.nodes_amount = nodes_amount
+        self.c = c
+        self.next_id = 0
+        dtype = views_frame_dtype(nodes_amount, c)
+        # A new file reads as zeros: empty views, every node in cluster 0.
+        with open(path, "wb") as file:
+            offset = write_header(file, {"nodes": nodes_amount, "c": c, "keyframes": 1, "layout": "views"})
+            file.truncate(offset + dtype.itemsize)
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        # No readahead: partners are spread over the whole file.
+        self._map.madvise(mmap.MADV_RANDOM)
+        self.offset = offset
+        self.frame = np.ndarray(1, dtype=dtype, buffer=self._map, offset=offset)
+        for field in self.FIELDS:
+            setattr(self, field, self.frame["nodes"][0][field])
+
+    def release(self):
+        # Dirty pages stay in the page cache and are written back by the kernel.
+        self._map.madvise(mmap.MADV_DONTNEED)
+
+    def append_frame(self, block_size: int = 1 << 24):
+        end = self.offset + self.frame.dtype.itemsize
+        with open(self.path, "ab") as file:
+            for start in range(self.offset, end, block_size):
+                file.write(self._map[start:min(start + block_size, end)])
+                self.release()
+
+    def close(self, unlink: bool = False):
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        self.frame = None
+        self._map.flush()
+        self._map.close()
+        self._file.close()
+        if unlink:
+            os.remove(self.path)
+
+
+class MappedCluster(ArrayCluster):
+    def __init__(self, state: MappedViewState, fanout: int, c: int, S: int, P: int, X: float, tail: bool,
+                 rng: np.random.Generator = None, memory_budget: int = 1024, frame_every: int = 0):
+        super().__init__(state, fanout, c, S, P, X, tail, rng, batched=True)
+        self.chunk_size = chunk_size(memory_budget, c, fanout)
+        self.frame_every = frame_every
+
+    def chunks(self):
+        for start in range(0, self.state.nodes_amount, self.chunk_size):
+            yield start + np.flatnonzero(self.state.cluster[start:start + self.chunk_size] == self.id)
+
+    def initialize_nodes(self, nodes: np.ndarray):
+        for start in range(0, len(nodes), self.chunk_size):
+            super().initialize_nodes(nodes[start:start + self.chunk_size])
+            self.state.release()
+
+    def initialize_overlay(self, views: Views):
+        views = cap_views(views, self.c, self.rng)
+        for members in self.chunks():
+            self._initialize_rows(views, members)
+            self.state.release()
+
+    def partition(self, nodes: np.ndarray) -> ArrayCluster:
+        partition = super().partition(nodes)
+        self.state.release()
+        return partition
+
+    def simulate_tick(self, i: int):
+        for initiators in self.chunks():
+            self._simulate_tick_batched(initiators)
+            self.state.release()
+        self.state.frame["tick"] = i
+        if self.frame_every and i % self.frame_every == 0:
+            self.state.append_frame()
+        self.tick += 1
+        self.notify(i)
+
+    def close(self, unlink: bool = False):
+        self.state.close(unlink)
@@ -0,0 +1,48 @@
+from typing import List, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from store import Snapshot
+
+# Metrics of a snapshot of the overlay, shared by the observers of the simulation and by the
+# analysis of stored runs, whose overlays are snapshots as well.
+
+
+def adjacency(snapshot: Snapshot) -> sp.csr_matrix:
+    # 0/1 adjacency without self loops, as the views are read by networkx.
+    cluster, indptr, indices = snapshot
+    n = len(cluster)
+    a = sp.csr_matrix((np.ones(len(indices), dtype=np.int64), indices, indptr), shape=(n, n))
+    a.setdiag(0)
+    a.eliminate_zeros()
+    a.sum_duplicates()
+    a.data[:] = 1
+    return a
+
+
+def clustering(snapshot: Snapshot, nodes: np.ndarray = None, chunk_size: int = 4096) -> np.ndarray:
+    # Directed clustering as in nx.clustering: with S = A + A^T, node i has (S^3)_ii / 2 directed
+    # triangles out of dtot (dtot - 1) - 2 drecip possible ones. S^2 is only built for a chunk
+    # of rows at a time, which bounds memory to chunk_size * dtot^2 entries.
+    a = adjacency(snapshot)
+    s = (a + a.T).tocsr()
+    nodes = np.arange(s.shape[0]) if nodes is None else np.asarray(nodes)
+    dtot = np.asarray(s.sum(axis=1)).ravel()[nodes]
+    drecip = np.asarray(a.multiply(a.T).sum(axis=1)).ravel()[nodes]
+    triangles = np.empty(len(nodes))
+    for start in range(0, len(nodes), chunk_size):
+        rows = s[nodes[start:start + chunk_size]]
+        triangles[start:start + chunk_size] = np.asarray((rows @ s).multiply(rows).sum(axis=1)).ravel()
+    possible = 2 * (dtot * (dtot - 1) - 2 * drecip)
+    return np.divide(triangles, possible, out=np.zeros(len(nodes)), where=possible > 0)
+
+
+def dead_links(snapshot: Snapshot, partitions_n: int) -> Tuple[List[int], int]:
+    # Links from nodes of cluster 0 to nodes partitioned away, by the cluster they point to, and
+    # the number of nodes left in cluster 0.
+    cluster, indptr, indices = snapshot
+    src = np.repeat(cluster, np.diff(indptr))
+    dst = cluster[indices]
+    links = np.bincount(dst[(src == 0) & (dst != 0)], minlength=partitions_n)
+    return links.tolist(), int(np.count_nonzero(cluster == 0))
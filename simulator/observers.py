@@ -0,0 +1,237 @@
+import csv
+import os.path
+from typing import Callable, Iterable, List, Tuple
+
+import numpy as np
+from scipy.sparse.csgraph import connected_components, shortest_path
+
+from metrics import adjacency, clustering, dead_links
+from store import Snapshot
+
+# Observers are called with every tick and the snapshot of the overlay right after it was
+# simulated. Metrics turn a snapshot into a few scalar columns of the run's time series.
+SERIES_SUFFIX = "pex.series.tsv"
+
+Observer = Callable[[int, Snapshot], None]
+
+
+class Observable:
+    observers: Tuple[Observer, ...] = ()
+
+    def observe(self, observer: Observer):
+        self.observers += (observer,)
+
+    def __getstate__(self):
+        # Observers hold open files; a restored engine gets them attached again.
+        state = self.__dict__.copy()
+        state.pop("observers", None)
+        return state
+
+    def notify(self, tick: int):
+        if not self.observers:
+            return
+        snapshot = self.snapshot()
+        for observer in self.observers:
+            observer(tick, snapshot)
+
+
+class OverlayStats:
+    # Counters of the object engine's overlay, updated edge by edge as views change. Plain lists,
+    # as they are updated one element at a time from the gossip loop. The version changes with
+    # every change of a view, including reorders, and keys what is built from the views.
+    def __init__(self, nodes_amount: int):
+        self.nodes_amount = nodes_amount
+        self.version = 0
+        self.edges = 0
+        self.outdegree = [0] * nodes_amount
+        self.indegree = [0] * nodes_amount
+        self.indegree_histogram = [nodes_amount]
+        self.cluster = [0] * nodes_amount
+        self.cluster_sizes = [nodes_amount]
+        # Links from nodes of cluster 0 to nodes of cluster p, by p.
+        self.dead_links = [0]
+
+    def add_edge(self, src: int, dst: int):
+        self.edges += 1
+        self.outdegree[src] += 1
+        d = self.indegree[dst]
+        self.indegree[dst] = d + 1
+        self.indegree_histogram[d] -= 1
+        if d + 1 == len(self.indegree_histogram):
+            self.indegree_histogram.append(0)
+        self.indegree_histogram[d + 1] += 1
+        self._count_link(src, dst, 1)
+
+    def remove_edge(self, src: int, dst: int):
+        self.edges -= 1
+        self.outdegree[src] -= 1
+        d = self.indegree[dst]
+        self.indegree[dst] = d - 1
+        self.indegree_histogram[d] -= 1
+        self.indegree_histogram[d - 1] += 1
+        self._count_link(src, dst, -1)
+
+    def set_cluster(self, node: int, cluster_id: int, successors: Iterable[int], predecessors: Iterable[int]):
+        self.version += 1
+        successors, predecessors = list(successors), [src for src in predecessors if src != node]
+        for dst in successors:
+            self._count_link(node, dst, -1)
+        for src in predecessors:
+            self._count_link(src, node, -1)
+        while cluster_id >= len(self.cluster_sizes):
+            self.cluster_sizes.append(0)
+            self.dead_links.append(0)
+        self.cluster_sizes[self.cluster[node]] -= 1
+        self.cluster_sizes[cluster_id] += 1
+        self.cluster[node] = cluster_id
+        for dst in successors:
+            self._count_link(node, dst, 1)
+        for src in predecessors:
+            self._count_link(src, node, 1)
+
+    def _count_link(self, src: int, dst: int, sign: int):
+        if self.cluster[src] == 0 and self.cluster[dst] != 0:
+            self.dead_links[self.cluster[dst]] += sign
+
+    def check(self, tick: int, snapshot: Snapshot):
+        # Debug observer: compare every counter with a full recomputation from the snapshot.
+        cluster, indptr, indices = snapshot
+        expected = OverlayStats(len(cluster))
+        expected.edges = len(indices)
+        expected.outdegree = np.diff(indptr).tolist()
+        expected.indegree = np.bincount(indices, minlength=len(cluster)).tolist()
+        expected.indegree_histogram = np.bincount(expected.indegree, minlength=len(self.indegree_histogram)).tolist()
+        expected.cluster = cluster.tolist()
+        expected.cluster_sizes = np.bincount(cluster, minlength=len(self.cluster_sizes)).tolist()
+        src, dst = np.repeat(cluster, np.diff(indptr)), cluster[indices]
+        expected.dead_links = np.bincount(dst[(src == 0) & (dst != 0)], minlength=len(self.dead_links)).tolist()
+        for name in ("edges", "outdegree", "indegree", "indegree_histogram", "cluster", "cluster_sizes",
+                     "dead_links"):
+            if getattr(self, name) != getattr(expected, name):
+                raise RuntimeError(f"Overlay counter {name} diverged from the overlay at tick {tick}")
+
+
+def series_path(run_id: str, folder: str) -> str:
+    folder = os.path.join(folder, run_id) if folder else run_id
+    return os.path.join(folder, f"{run_id}.{SERIES_SUFFIX}")
+
+
+class Metric:
+    columns: List[str] = []
+
+    def compute(self, tick: int, snapshot: Snapshot) -> List[float]:
+        raise NotImplementedError
+
+
+class Distribution(Metric):
+    # Read from the overlay counters instead of the snapshot when there are any.
+    def __init__(self, name: str, inbound: bool, outbound: bool, stats: OverlayStats = None):
+        self.columns = [f"{name}_{stat}" for stat in ("mean", "min", "p5", "p50", "p95", "max")]
+        self.inbound = inbound
+        self.outbound = outbound
+        self.stats = stats
+
+    def compute(self, tick: int, snapshot: Snapshot) -> List[float]:
+        cluster, indptr, indices = snapshot
+        values = np.zeros(len(cluster), dtype=np.int64)
+        if self.inbound:
+            values += self.stats.indegree if self.stats else np.bincount(indices, minlength=len(cluster))
+        if self.outbound:
+            values += self.stats.outdegree if self.stats else np.diff(indptr)
+        return [values.mean(), values.min(), *np.percentile(values, [5, 50, 95]), values.max()]
+
+
+class DeadLinks(Metric):
+    # Links from nodes of cluster 0 to nodes partitioned away, by the cluster they point to.
+    def __init__(self, partitions_n: int, stats: OverlayStats = None):
+        self.partitions_n = partitions_n
+        self.columns = ["nodes_0"] + [f"dead_links_{p}" for p in range(1, partitions_n)]
+        self.stats = stats
+
+    def compute(self, tick: int, snapshot: Snapshot) -> List[float]:
+        if self.stats:
+            links = self.stats.dead_links + [0] * (self.partitions_n - len(self.stats.dead_links))
+            return [self.stats.cluster_sizes[0], *links[1:self.partitions_n]]
+        links, nodes_0 = dead_links(snapshot, self.partitions_n)
+        return [nodes_0, *links[1:self.partitions_n]]
+
+
+class Connectivity(Metric):
+    columns = ["weakly_connected", "largest_component"]
+
+    def compute(self, tick: int, snapshot: Snapshot) -> List[float]:
+        components, labels = connected_components(adjacency(snapshot), directed=True, connection="weak")
+        return [int(components == 1), np.bincount(labels).max() / len(labels)]
+
+
+class Clustering(Metric):
+    # Average directed clustering over sampled nodes, as nx.average_clustering.
+    columns = ["average_clustering"]
+
+    def __init__(self, samples: int = 1000):
+        self.samples = samples
+
+    def compute(self, tick: int, snapshot: Snapshot) -> List[float]:
+        n = len(snapshot[0])
+        nodes = np.sort(np.random.default_rng(tick).choice(n, min(self.samples, n), replace=False))
+        return [clustering(snapshot, nodes).mean()]
+
+
+class PathLength(Metric):
+    # Mean shortest path over the pairs reachable from sampled BFS sources.
+    columns = ["path_length", "reachable"]
+
+    def __init__(self, sources: int = 64):
+        self.sources = sources
+
+    def compute(self, tick: int, snapshot: Snapshot) -> List[float]:
+        a = adjacency(snapshot)
+        n = a.shape[0]
+        sources = np.random.default_rng(tick).choice(n, min(self.sources, n), replace=False)
+        distances = shortest_path(a, method="D", unweighted=True, indices=sources)
+        reachable = np.isfinite(distances) & (distances > 0)
+        return [distances[reachable].mean() if reachable.any() else float("nan"),
+                reachable.sum() / (len(sources) * max(n - 1, 1))]
+
+
+# Factories taking the number of partitions and the overlay counters of the engine, if it keeps any.
+METRICS = {
+    "degree": lambda partitions_n, stats: Distribution("degree", inbound=True, outbound=True, stats=stats),
+    "indegree": lambda partitions_n, stats: Distribution("indegree", inbound=True, outbound=False, stats=stats),
+    "dead_links": DeadLinks,
+    "connectivity": lambda partitions_n, stats: Connectivity(),
+    "clustering": lambda partitions_n, stats: Clustering(),
+    "path_length": lambda partitions_n, stats: PathLength(),
+}
+
+
+class SeriesWriter:
+    # One tab separated row of metric columns per tick. A prefix (path, tick) starts the series
+    # with the rows up to that tick of another one, or of the same one to resume it; columns that
+    # series lacks belong to partitions made after that tick and are 0.
+    def __init__(self, path: str, metrics: List[Metric], prefix: Tuple[str, int] = None):
+        self.metrics = metrics
+        columns = ["tick"] + [column for metric in metrics for column in metric.columns]
+        rows = []
+        if prefix:
+            with open(prefix[0], newline="") as file:
+                rows = [row for row in csv.DictReader(file, delimiter="\t") if int(row["tick"]) <= prefix[1]]
+        self._file = open(path, "w", newline="")
+        self._writer = csv.writer(self._file, delimiter="\t")
+        self._writer.writerow(columns)
+        self._writer.writerows([row.get(column, "0") for column in columns] for row in rows)
+
+    def write(self, tick: int, snapshot: Snapshot):
+        row = [tick]
+        for metric in self.metrics:
+            row.extend(f"{value:.10g}" for value in metric.compute(tick, snapshot))
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
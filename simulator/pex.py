@@ -1,52 +1,47 @@
+import csv
+import hashlib
+import heapq
+import itertools
 import numpy as np
 import networkx as nx
 import os.path
+import pickle
 import random
-import string
-from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from enum import IntEnum, auto
-from typing import List, Dict
+from operator import attrgetter
+from typing import List, Dict, Iterator, Tuple
 
 import click
-from influxdb import InfluxDBClient
+
+from engine import ArrayCluster, ViewState
+from influx import InfluxWriter
+from mapped import MappedCluster, MappedViewState
+from observers import METRICS, SERIES_SUFFIX, Observable, OverlayStats, SeriesWriter, series_path
+from scheduler import EventScheduler
+from sharded import SharedViewState, ShardedCluster
+from store import RUN_SUFFIX, RunWriter, Snapshot, copy_run, run_path, snapshot_edges, snapshot_to_networkx
+from topology import Topology, Views, build_views, cap_views
 
 nodes: List["Node"] = []
+CHECKPOINT_SUFFIX = "pex.ckpt"
+_hop = attrgetter("hop")
 
 
-class Topology(IntEnum):
-    RING = auto()
-    RAND = auto()
+class Engine(IntEnum):
+    OBJECT = auto()
+    ARRAY = auto()
+    SHARDED = auto()
 
     @staticmethod
     def from_string(name: str):
-        if name == "rand":
-            return Topology.RAND
-        if name == "ring":
-            return Topology.RING
-        raise ValueError("Invalid topology name")
-
-
-def are_neighbors(topology, i: int, j: int, nodes_amount: int):
-    if topology == Topology.RING:
-        if i + 1 == j or j + 1 == i:
-            return True
-        if i == 0 and j == nodes_amount - 1:
-            return True
-        if j == 0 and i == nodes_amount - 1:
-            return True
-    if topology is Topology.RAND:
-        r = random.Random()
-        r.seed(1234)
-        index = [k for k in range(nodes_amount)]
-        r.shuffle(index)
-        i, j = index[i], index[j]
-        if i + 1 == j or j + 1 == i:
-            return True
-        if i == 0 and j == nodes_amount - 1:
-            return True
-        if j == 0 and i == nodes_amount - 1:
-            return True
-    return False
+        if name == "object":
+            return Engine.OBJECT
+        if name == "array":
+            return Engine.ARRAY
+        if name == "sharded":
+            return Engine.SHARDED
+        raise ValueError("Invalid engine name")
 
 
 class Record:
@@ -68,11 +63,14 @@ class Record:
 
 
 class Node:
+    # Records in a view are aged lazily: their hop is relative to the node's age, which counts
+    # its pulls, so the actual hop is record.hop + age and aging the view is one increment.
+    # Records in pull buffers carry actual hops.
     def __init__(self, index: int):
         self.index: int = index
         self.neighbors: List[Record] = []
+        self.age = 0
         self._pull_buffer: List[Record] = []
-        self._cluster: Cluster = None
 
     def __str__(self):
         return f"Node<{self.index}>"
@@ -88,16 +86,27 @@ class Node:
     def from_record(record: Record) -> "Node":
         return nodes[record.index]
 
-    def set_cluster(self, cluster: "Cluster"):
-        self._cluster = cluster
-
     def select_neighbors_rand(self, fanout: int):
         return random.sample(self.neighbors, k=fanout)
 
     def select_neighbors_tail(self, fanout: int):
-        return sorted(self.neighbors, key= lambda r: r.hop, reverse=True)[:fanout]
+        return heapq.nlargest(fanout, self.neighbors, key=_hop)
+
+
+def split_oldest(records: List[Record], P: int) -> Tuple[List[Record], List[Record]]:
+    # The P oldest records and the others, both by descending hop. Callers shuffle the others,
+    # so without P there is nothing to sort. A heap selection of the P oldest is slower than
+    # the C sort for views of up to a few hundred records.
+    if not P:
+        return [], list(records)
+    records = sorted(records, key=_hop, reverse=True)
+    return records[:P], records[P:]
+
 
-class Cluster:
+class Cluster(Observable):
+    # The views of the nodes are the only state. Clusters of a run share the node -> cluster
+    # array and the overlay counters; the overlay itself is only built when it is asked for,
+    # and kept until the next change of a view.
     next_id = 0
 
     def __init__(self, fanout: int, c: int, S: int, P: int, X: float, tail: bool):
@@ -106,45 +115,83 @@ class Cluster:
         self.S = S
         self.P = P
         self.D = X
-        self.overlay = nx.DiGraph()
-        self.nodes: Dict[int, Node] = {}
+        self.stats = OverlayStats(len(nodes))
+        self.membership = np.zeros(len(nodes), dtype=np.int32)
         self.tick = 0
         self.tail = tail
         self.id = Cluster.next_id
         Cluster.next_id += 1
-
-    def initialize_nodes(self, nodes: List[Node]):
+        self._cache = {}
+        self._cache_version = -1
+
+    def initialize_nodes(self, members: List[Node]):
+        indices = [node.index for node in members]
+        self.membership[indices] = self.id
+        moved = set(indices)
+        predecessors = {i: [] for i in indices}
         for node in nodes:
-            self.nodes[node.index] = node
-            node.set_cluster(self)
-            if self.overlay.has_node(node.index):
-                self.overlay.nodes[node.index]["cluster"] = self.id
-            else:
-                self.overlay.add_node(node.index, cluster=self.id)
-
-    def initialize_overlay(self, topology: Topology):
-        for i, node in self.nodes.items():
-            for j, neighbor in self.nodes.items():
-                if i == j:
-                    continue
-                if are_neighbors(topology, i, j, len(self.nodes)):
-                    record = neighbor.record
-                    record.hop += 1
-                    node.neighbors.append(record)
-                    self.overlay.add_edge(node.index, neighbor.index)
-
+            for j in moved.intersection(r.index for r in node.neighbors):
+                predecessors[j].append(node.index)
+        for i in indices:
+            self.stats.set_cluster(i, self.id, {r.index for r in nodes[i].neighbors}, predecessors[i])
+
+    def initialize_overlay(self, views: Views):
+        views = cap_views(views, self.c, np.random)
+        for node in self.members():
+            linked = set()
+            for j in views.neighbors(node.index).tolist():
+                record = nodes[j].record
+                record.hop += 1 - node.age
+                node.neighbors.append(record)
+                if j not in linked:
+                    linked.add(j)
+                    self.stats.add_edge(node.index, j)
+
+    def member_indices(self) -> List[int]:
+        return np.flatnonzero(self.membership == self.id).tolist()
+
+    def members(self) -> List[Node]:
+        return [nodes[i] for i in self.member_indices()]
+
+    def views(self) -> Iterator[Tuple[int, List[int], int]]:
+        for node in self.members():
+            yield node.index, [r.index for r in node.neighbors], self.id
+
+    def snapshot(self) -> Snapshot:
+        return self._cached("snapshot", self._snapshot)
+
+    def edges(self) -> np.ndarray:
+        return self._cached("edges", lambda: snapshot_edges(self.snapshot()))
 
-    def partition(self, nodes: List[Node]) -> "Cluster":
+    @property
+    def overlay(self) -> nx.DiGraph:
+        return self._cached("overlay", lambda: snapshot_to_networkx(self.snapshot()))
+
+    def _cached(self, form: str, build):
+        if self._cache_version != self.stats.version:
+            self._cache = {}
+            self._cache_version = self.stats.version
+        if form not in self._cache:
+            self._cache[form] = build()
+        return self._cache[form]
+
+    def _snapshot(self) -> Snapshot:
+        indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+        np.cumsum([len(node.neighbors) for node in nodes], out=indptr[1:])
+        indices = np.fromiter((r.index for node in nodes for r in node.neighbors), dtype=np.int32,
+                              count=indptr[-1])
+        return self.membership.copy(), indptr, indices
+
+    def partition(self, members: List[Node]) -> "Cluster":
         partition = Cluster(self.fanout, self.c, self.S, self.P,
                             self.D, self.tail)
-        partition.overlay = self.overlay
-        partition.initialize_nodes(nodes)
-        for node in nodes:
-            self.nodes.pop(node.index)
+        partition.stats = self.stats
+        partition.membership = self.membership
+        partition.initialize_nodes(members)
         return partition
 
     def simulate_tick(self, i: int):
-        for node in self.nodes.values():
+        for node in self.members():
             neighbor_records = node.select_neighbors_tail(self.fanout) if self.tail else node.select_neighbors_rand(
                 self.fanout)
             for record in neighbor_records:
@@ -157,26 +204,46 @@ class Cluster:
                 self._pull(node, neighbor)
                 self._pull(neighbor, node)
         self.tick += 1
+        self.notify(i)
+
+    # Single exchanges by node index, for the asynchronous scheduler.
+    def is_member(self, index: int) -> bool:
+        return self.membership[index] == self.id
+
+    def partners(self, index: int) -> List[int]:
+        node = nodes[index]
+        records = node.select_neighbors_tail(self.fanout) if self.tail else node.select_neighbors_rand(self.fanout)
+        return [record.index for record in records]
+
+    def send(self, index: int, peer: int) -> List[Record]:
+        neighbor = nodes[peer]
+        self._push(nodes[index], neighbor)
+        records, neighbor._pull_buffer = neighbor._pull_buffer, []
+        return records
+
+    def receive(self, index: int, peer: int, records: List[Record]):
+        node = nodes[index]
+        node._pull_buffer = records
+        self._pull(node, nodes[peer])
 
     def _push(self, node: Node, neighbor: Node):
-        sorted_records = sorted(node.neighbors, key=lambda r: r.hop, reverse=True)
-        P = min(self.P, len(sorted_records))
-        youngest, oldest = sorted_records[P:], sorted_records[:P]
+        self.stats.version += 1
+        oldest, youngest = split_oldest(node.neighbors, min(self.P, len(node.neighbors)))
         np.random.shuffle(youngest)
         node.neighbors = youngest + oldest
         c = min((self.c // 2) - 1, len(node.neighbors))
-        neighbor._pull_buffer = [n.copy() for n in node.neighbors[:c]]
+        neighbor._pull_buffer = [Record(r.index, r.hop + node.age) for r in node.neighbors[:c]]
         neighbor._pull_buffer.append(node.record)
 
     def _pull(self, node: Node, neighbor: Node):
+        self.stats.version += 1
         records = self._merge_records(node)
         S = min(self.S, max(len(records) - self.c, 0))
         records = records[S:]
 
         P = min(self.P, len(records), self.c)
 
-        records = sorted(records, key=lambda r: r.hop, reverse=True)
-        oldest, records = records[:P], records[P:]
+        oldest, records = split_oldest(records, P)
         np.random.shuffle(records)
         while len(oldest) + len(records) > self.c and oldest and random.random() < self.D:
             oldest = oldest[1:]
@@ -187,26 +254,26 @@ class Cluster:
 
         s_old, s_new = set(map(lambda n: n.index, node.neighbors)), set(map(lambda n: n.index, records))
         for i in s_old - s_new:
-            self.overlay.remove_edge(node.index, i)
+            self.stats.remove_edge(node.index, i)
         for i in s_new - s_old:
-            self.overlay.add_edge(node.index, i)
+            self.stats.add_edge(node.index, i)
 
         node.neighbors = records
-        for neighbor in node.neighbors:
-            neighbor.hop += 1
+        node.age += 1
 
     def _merge_records(self, node: Node) -> List[Record]:
         buffer: List[Record] = []
         pull_set = dict((r.index, r) for r in node._pull_buffer)
         for r1 in node.neighbors:
             r2 = pull_set.get(r1.index, None)
-            if not r2 or r1.hop <= r2.hop:
+            if not r2 or r1.hop + node.age <= r2.hop:
                 buffer.append(r1)
 
         buffer_set = dict((r.index, r) for r in buffer)
         for r1 in node._pull_buffer:
             r2 = buffer_set.get(r1.index, None)
             if r1.index != node.index and not r2:
+                r1.hop -= node.age
                 buffer.append(r1)
 
         return buffer
@@ -227,7 +294,7 @@ class Cluster:
         return _filter
 
     def __str__(self):
-        return f"Cluster<{self.id}:{len(self.nodes)}>"
+        return f"Cluster<{self.id}:{np.count_nonzero(self.membership == self.id)}>"
 
     def __repr__(self):
         return str(self)
@@ -246,35 +313,40 @@ class PartitionType(IntEnum):
         raise ValueError("Invalid partition type name")
 
 
-def partition_nodes(partition_type, nodes: List[Node], partition_size: int) -> List[Node]:
+def partition_nodes(partition_type, nodes: list, partition_size: int) -> list:
+    # Array engines pass their member indices as an array, which is sampled without a list of them.
+    k = min(len(nodes), partition_size)
     if partition_type is PartitionType.RAND:
-        return random.sample(nodes, k=min(len(nodes), partition_size))
+        if isinstance(nodes, np.ndarray):
+            return np.sort(nodes[np.random.default_rng(random.getrandbits(64)).choice(len(nodes), k, replace=False)])
+        return random.sample(nodes, k=k)
     elif partition_type is PartitionType.LINEAL:
-        return nodes[:min(len(nodes), partition_size)]
+        return nodes[:k]
     raise ValueError("Invalid partition type")
 
 
-def write_to_influx(cluster: Cluster, run_id: str, tick: int):
-    client = InfluxDBClient(host="localhost", port=8086)
-    client.switch_database("testground")
-    json_body = []
-    for node in cluster.nodes.values():
-        point = {
-            "measurement": "diagnostics.casm-pex-convergence.view.point",
-            "tags": {
-                "node": str(node.index),
-                "records": "-".join(map(lambda r: str(r.index), node.neighbors)),
-                "tick": tick,
-                "run": run_id,
-                "cluster": node._cluster.id
-            },
-            "time": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
-            "fields": {
-                "value": 0.0
-            }
-        }
-        json_body.append(point)
-    client.write_points(json_body)
+def new_cluster(engine: Engine, nodes_amount: int, fanout: int, c: int, s: int, p: int, d: float, tail: bool,
+                batched: bool = False, rng: np.random.Generator = None, workers: int = 1, memory_budget: int = None,
+                path: str = None, frame_every: int = 0):
+    global nodes
+    Cluster.next_id = 0
+    if engine is Engine.ARRAY and memory_budget:
+        cluster = MappedCluster(MappedViewState(path, nodes_amount, c), fanout, c, s, p, d, tail, rng, memory_budget,
+                                frame_every)
+        cluster.initialize_nodes(np.arange(nodes_amount))
+        return cluster
+    if engine is Engine.SHARDED:
+        cluster = ShardedCluster(SharedViewState(nodes_amount, c), fanout, c, s, p, d, tail, rng, workers)
+        cluster.initialize_nodes(list(range(nodes_amount)))
+        return cluster
+    if engine is Engine.ARRAY:
+        cluster = ArrayCluster(ViewState(nodes_amount, c), fanout, c, s, p, d, tail, rng, batched)
+        cluster.initialize_nodes(list(range(nodes_amount)))
+        return cluster
+    nodes = [Node(node_id) for node_id in range(nodes_amount)]
+    cluster = Cluster(fanout, c, s, p, d, tail)
+    cluster.initialize_nodes(nodes)
+    return cluster
 
 
 def write_info_to_file(run_id: str, params: Dict[str, int], folder: str):
@@ -287,16 +359,248 @@ def write_info_to_file(run_id: str, params: Dict[str, int], folder: str):
             file.write(f"{param}={value}\n")
 
 
-def write_to_file(cluster: Cluster, run_id: str, tick: int, folder: str):
+# Parameters the views of a run depend on. With the master seed, and the repetition for a run,
+# they name the run and the index of its simulation, so reruns replace the same files and
+# different parameters never share them.
+RUN_PARAMS = ("ticks", "nodes_amount", "fanout", "c", "s", "p", "d", "tail", "partitions", "engine", "batched",
+              "topology", "degree", "rewire", "asynchronous", "jitter", "latency", "workers", "memory_budget")
+
+
+def simulation_run_id(params: Dict[str, object], seed: int, rep: int = None) -> str:
+    values = [params[name].name.lower() if isinstance(params[name], IntEnum) else params[name] for name in RUN_PARAMS]
+    key = ",".join(f"{name}={value}" for name, value in zip(RUN_PARAMS, values)) + f",{seed}"
+    if rep is not None:
+        key += f",{rep}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def read_index(output_file: str) -> List[str]:
+    if not os.path.isfile(output_file):
+        return []
+    with open(output_file) as file:
+        return [line.strip() for line in file.readlines()[1:] if line.strip()]
+
+
+def write_index(output_file: str, nodes_amount: int, runs: List[str]):
+    # Rewrite the whole index and swap it in, so readers never see a partial file.
+    tmp_file = f"{output_file}.tmp"
+    with open(tmp_file, "w") as file:
+        file.write(f"{nodes_amount} {len(runs)} \n")
+        for run in runs:
+            file.write(f"{run}\n")
+    os.replace(tmp_file, output_file)
+
+
+def checkpoint_path(run_id: str, folder: str, tick: int) -> str:
     folder = os.path.join(folder, run_id) if folder else run_id
-    output_file = os.path.join(folder, f"{run_id}.{tick}.partition.sim")
-    if not os.path.isdir(folder):
-        os.mkdir(folder)
+    return os.path.join(folder, f"{run_id}.{tick}.{CHECKPOINT_SUFFIX}")
+
+
+def checkpoint_folder(path: str) -> str:
+    # Output folder of the run a checkpoint belongs to, as passed to run_simulation.
+    return os.path.dirname(os.path.dirname(path)) or None
+
+
+def save_checkpoint(path: str, params: Dict[str, object], tick: int, cluster, scheduler: EventScheduler = None):
+    # Two pickles: the parameters of the run, which is all resume and fork read up front, then
+    # the state. Engines, views and random streams pickle as they are, except for observers.
+    state = {"cluster": cluster, "scheduler": scheduler, "nodes": nodes if isinstance(cluster, Cluster) else [],
+             "next_id": Cluster.next_id, "random": random.getstate(), "np_random": np.random.get_state()}
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, "wb") as file:
+        pickle.dump({"params": params, "tick": tick}, file, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(state, file, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, path)
+
+
+def read_checkpoint(path: str) -> Tuple[Dict[str, object], int]:
+    with open(path, "rb") as file:
+        header = pickle.load(file)
+    return header["params"], header["tick"]
+
+
+def load_checkpoint(path: str) -> Tuple[Dict[str, object], int, object, EventScheduler]:
+    global nodes
+    with open(path, "rb") as file:
+        header = pickle.load(file)
+        state = pickle.load(file)
+    nodes = state["nodes"]
+    Cluster.next_id = state["next_id"]
+    random.setstate(state["random"])
+    np.random.set_state(state["np_random"])
+    return header["params"], header["tick"], state["cluster"], state["scheduler"]
+
+
+def run_simulation(seed: int, rep: int, repetitions: int, ticks: int, nodes_amount: int, fanout: int,
+                   c: int, s: int, p: int, d: float, tail: bool, partitions: List[Tuple[int, int]],
+                   influx: bool, folder: str, engine: Engine, batched: bool, topology: Topology,
+                   degree: int, rewire: float, keyframes: int = 1, influx_host: str = "localhost:8086",
+                   run_id: str = None, observe: List[str] = (), snapshots: bool = True,
+                   check_stats: bool = False, asynchronous: bool = False, jitter: float = 0.1,
+                   latency: float = 0.05, workers: int = 1, memory_budget: int = None, frame_every: int = 0,
+                   checkpoints: List[int] = (), checkpoint_every: int = 0, resume_from: str = None) -> str:
+    # The arguments of the run go into its checkpoints, for resume and fork to call this again.
+    params = {name: value for name, value in locals().items() if name != "resume_from"}
+    start = 0
+    if resume_from:
+        # Resumed and forked runs go on from the checkpoint's state and random streams, with the
+        # files of the run it was taken from up to its tick. S, P and D may differ in a fork.
+        parent, start, c0, scheduler = load_checkpoint(resume_from)
+        parent_folder, parent_id = os.path.dirname(resume_from), parent["run_id"]
+        c0.S, c0.P, c0.D = s, p, d
+        scheduler = scheduler or c0
+    else:
+        # Repetition `rep` of master seed `seed` always draws from the same independent stream.
+        stream = np.random.SeedSequence(seed, spawn_key=(rep,))
+        py_seed, np_seed = stream.generate_state(2)
+        random.seed(int(py_seed))
+        np.random.seed(np_seed)
+        rng = np.random.default_rng(stream)
+        run_id = run_id or simulation_run_id(params, seed, rep)
+        params["run_id"] = run_id
+    partition_type = PartitionType.RAND
+    write_info_to_file(run_id, {"S": s, "P": p, "D": d, "c": c, "tail": tail, "seed": seed, "repetition": rep},
+                       folder)
+
+    if not resume_from:
+        c0 = new_cluster(engine, nodes_amount, fanout, c, s, p, d, tail, batched, rng, workers, memory_budget,
+                         run_path(run_id, folder), frame_every)
+    try:
+        if not resume_from:
+            # Capped here, so that every engine starts from the same views for the same seed.
+            c0.initialize_overlay(cap_views(build_views(topology, nodes_amount, degree, rewire, rng), c, rng))
+            scheduler = EventScheduler(c0, jitter=jitter, latency=latency, rng=rng) if asynchronous else c0
+        writer = store = series = None
+        if influx:
+            host, _, port = influx_host.partition(":")
+            writer = InfluxWriter(host, int(port or 8086))
+        elif snapshots and not memory_budget:
+            # Out-of-core runs keep their views in the run store itself, with the last tick and copies
+            # of every frame_every ticks.
+            if start:
+                copy_run(os.path.join(parent_folder, f"{parent_id}.{RUN_SUFFIX}"), run_path(run_id, folder), start)
+            store = RunWriter(run_path(run_id, folder), nodes_amount, c, keyframes, append=bool(start))
+            if start:
+                store.resume(c0.snapshot())
+            c0.observe(store.write)
+        if observe:
+            stats = getattr(c0, "stats", None)
+            prefix = (os.path.join(parent_folder, f"{parent_id}.{SERIES_SUFFIX}"), start) if start else None
+            series = SeriesWriter(series_path(run_id, folder),
+                                  [METRICS[name](len(partitions) + 1, stats) for name in observe], prefix)
+            c0.observe(series.write)
+        if check_stats:
+            c0.observe(c0.stats.check)
+
+        if start:
+            print(f"{nodes_amount} - Run {run_id} ({rep + 1}/{repetitions}) resumed from tick {start} of {parent_id}")
+        else:
+            print(f"{nodes_amount} - Run {run_id} ({rep + 1}/{repetitions}) started")
+        for tick in range(start + 1, ticks + 1):
+            print(f"N={nodes_amount}({rep + 1}/{repetitions}) - Tick {tick}/{ticks}...")
+            for partition_tick, partition_size in partitions:
+                if partition_tick and tick == partition_tick:
+                    members = c0.members() if engine is Engine.OBJECT else c0.member_indices()
+                    pnodes = partition_nodes(partition_type, members, partition_size)
+                    c0.partition(pnodes)
+                    print(f"Partitioned: {c0}")
+
+            scheduler.simulate_tick(tick)
+            if writer:
+                writer.write_views(c0.views(), run_id, tick)
+            if tick in checkpoints or checkpoint_every and tick % checkpoint_every == 0:
+                save_checkpoint(checkpoint_path(run_id, folder, tick), params, tick, c0,
+                                scheduler if asynchronous else None)
+        if writer:
+            writer.close()
+            print(f"{nodes_amount} - Run {run_id} sent {writer.points} points ({writer.rate:.0f} points/s)")
+        if store:
+            store.close()
+        if series:
+            series.close()
+        if asynchronous:
+            print(f"{nodes_amount} - Run {run_id} processed {scheduler.events} events")
+        print(f"{nodes_amount} - Run {run_id} ({rep + 1}/{repetitions}) finished - {c0}")
+    finally:
+        # Shared memory and mapped views are released even if the run fails.
+        if engine is Engine.SHARDED:
+            c0.close()
+        elif memory_budget:
+            c0.close(unlink=influx or not snapshots)
+    return os.path.join(folder, run_id) if folder else run_id
+
+
+SWEEP_PARAMS = {"nodes": int, "fanout": int, "c": int, "S": int, "P": int, "D": float,
+                "tail": lambda v: v.lower() in ("1", "true", "yes")}
+SWEEP_COLUMNS = ["run", "nodes", "fanout", "c", "S", "P", "D", "tail", "ticks", "engine", "topology", "partition",
+                 "seed", "repetition"]
+
+
+def parse_partitions(value: str) -> List[Tuple[int, int]]:
+    # tick:size partitions joined by '+', or 'none'.
+    if value == "none":
+        return []
+    return [(int(item.split(":")[0]), int(item.split(":")[1])) for item in value.split("+")]
+
+
+# Parameters a fork may change: the rest of the state was fixed by the run up to the checkpoint.
+FORK_PARAMS = {"S": int, "P": int, "D": float, "partition": parse_partitions}
+
+
+def parse_point(items: List[str], params: Dict[str, object] = SWEEP_PARAMS) -> Dict[str, object]:
+    point = {}
+    for item in items:
+        name, value = item.split("=", 1)
+        if name not in params:
+            raise click.BadParameter(f"unknown parameter '{name}'")
+        point[name] = params[name](value)
+    return point
+
+
+def sweep_points(grid: List[str], points_file: str,
+                 params: Dict[str, object] = SWEEP_PARAMS) -> List[Dict[str, object]]:
+    if points_file:
+        with open(points_file) as file:
+            return [parse_point(line.split(), params) for line in file if line.strip() and not line.startswith("#")]
+    axes = [(name, values.split(",")) for name, values in (g.split("=", 1) for g in grid)]
+    return [parse_point([f"{name}={value}" for (name, _), value in zip(axes, values)], params)
+            for values in itertools.product(*(values for _, values in axes))]
+
+
+def sweep_run_id(point: Dict[str, object], seed: int, rep: int) -> str:
+    key = ",".join(f"{name}={point[name]}" for name in SWEEP_COLUMNS[1:-2]) + f",{seed},{rep}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def read_summary(summary_file: str) -> List[Dict[str, str]]:
+    if not os.path.isfile(summary_file):
+        return []
+    with open(summary_file, newline="") as file:
+        return list(csv.DictReader(file, delimiter="\t"))
+
+
+def append_summary(summary_file: str, row: Dict[str, object]):
+    new = not os.path.isfile(summary_file)
+    with open(summary_file, "a", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=SWEEP_COLUMNS, delimiter="\t")
+        if new:
+            writer.writeheader()
+        writer.writerow(row)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+@click.group()
+def cli1():
+    pass
 
-    nx.write_gpickle(cluster.overlay, output_file)
 
+@click.group()
+def cli2():
+    pass
 
-@click.command()
+
+@cli1.command()
 @click.option("-t", "--ticks", type=int, default=50)
 @click.option("-r", "--repetitions", type=int, default=1)
 @click.option("-n", "--nodes-amount", type=int, default=3)
@@ -308,49 +612,262 @@ def write_to_file(cluster: Cluster, run_id: str, tick: int, folder: str):
 @click.option("-T", "--tail", is_flag=True)
 @click.option("-p", "--partition", multiple=True, type=str)
 @click.option("--influx", is_flag=True)
+@click.option("--influx-host", type=str, default="localhost:8086", help="InfluxDB address as host:port.")
 @click.option('-f', '--folder', help="Output folder to store the file to.",
               type=str)
+@click.option("-e", "--engine", type=click.Choice(["object", "array", "sharded"]), default="object",
+              help="Simulation engine: per-record Python objects, preallocated NumPy view arrays, or view arrays in "
+                   "shared memory with the ticks split across worker processes (not faster than -b on a single core, "
+                   "untested on several). Ticks of the array engine are batched unless --sequential is given.")
+@click.option("-b", "--batched/--sequential", default=None,
+              help="Run all exchanges of a tick simultaneously (array engine only, its default), 10-15x faster per "
+                   "tick than sequential exchanges at 10k-50k nodes. Sequential exchanges of the array engine are no "
+                   "faster than the object engine: they exist only to reproduce sequential runs exactly and to "
+                   "gossip asynchronously.")
+@click.option("--topology", type=click.Choice(["ring", "rand", "regular", "small-world", "star", "seed"]),
+              default="ring", help="Shape of the initial views.")
+@click.option("--degree", type=int, default=4,
+              help="Degree of the regular and small-world topologies, or size of the seed list.")
+@click.option("--rewire", type=float, default=0.1, help="Rewiring probability of the small-world topology.")
+@click.option("-j", "--jobs", type=int, default=1, help="Number of repetitions to run in parallel.")
+@click.option("--seed", type=int, help="Master seed every repetition derives its own random stream from.")
+@click.option("-k", "--keyframes", type=int, default=1,
+              help="Store the full overlay every k ticks and only its changes in between.")
+@click.option("--first-repetition", type=int, default=0,
+              help="Index of the first repetition, to rerun single repetitions of a seeded experiment.")
+@click.option("-o", "--observe", multiple=True, type=click.Choice(list(METRICS)),
+              help="Metric computed after every tick into the run's time series file.")
+@click.option("--snapshots/--no-snapshots", default=True, help="Store the overlay of every tick in the run store.")
+@click.option("--check-stats", is_flag=True,
+              help="Check the overlay counters against a full recount after every tick (object engine only).")
+@click.option("-w", "--workers", type=int, default=1, help="Worker processes of the sharded engine.")
+@click.option("-a", "--asynchronous", is_flag=True,
+              help="Gossip on per-node timers with network latency instead of in synchronous ticks.")
+@click.option("--jitter", type=float, default=0.1,
+              help="Relative deviation of the per-node gossip intervals (asynchronous only).")
+@click.option("--latency", type=float, default=0.05,
+              help="Mean message latency in ticks, exponentially distributed (asynchronous only).")
+@click.option("-m", "--memory-budget", type=int,
+              help="Run out of core: the views are memory-mapped in the run store and ticks are batched over node "
+                   "chunks keeping about this many MiB resident (array engine only).")
+@click.option("--frame-every", type=int, default=0,
+              help="Out-of-core runs: also store the views every k ticks, to analyze them over time. Without it "
+                   "only the last tick is kept.")
+@click.option("--checkpoint", multiple=True, type=int,
+              help="Tick after which to save the state of the run, to resume or fork it from there.")
+@click.option("--checkpoint-every", type=int, default=0, help="Save the state of the run every k ticks.")
 def simulate(ticks: int, repetitions: int, nodes_amount: int, fanout: int,
              c: int, s: int, p: int, d: float, tail: bool, partition: List[str],
-             influx: bool, folder: str):
-    simulation_id = "".join(random.choices(string.ascii_lowercase + string.digits, k=16))
+             influx: bool, influx_host: str, folder: str, engine: str, batched: bool, topology: str,
+             degree: int, rewire: float, jobs: int, seed: int, keyframes: int, first_repetition: int,
+             observe: List[str], snapshots: bool, check_stats: bool, workers: int, asynchronous: bool,
+             jitter: float, latency: float, memory_budget: int, frame_every: int, checkpoint: List[int],
+             checkpoint_every: int):
+    seed = seed if seed is not None else np.random.SeedSequence().entropy
+    partitions = [(int(p.split(":")[0]), int(p.split(":")[1])) for p in partition]
+    engine = Engine.from_string(engine)
+    topology = Topology.from_string(topology)
+    if batched is None:
+        batched = engine is Engine.ARRAY and not asynchronous
+    if batched and engine is not Engine.ARRAY:
+        raise click.BadParameter("batched ticks require the array engine", param_hint="--batched")
+    if asynchronous and (batched or engine is Engine.SHARDED):
+        raise click.BadParameter("asynchronous gossip runs exchanges one at a time", param_hint="--asynchronous")
+    if check_stats and engine is not Engine.OBJECT:
+        raise click.BadParameter("overlay counters are kept by the object engine only", param_hint="--check-stats")
+    if memory_budget and (engine is not Engine.ARRAY or asynchronous):
+        raise click.BadParameter("out-of-core runs use batched ticks of the array engine", param_hint="--memory-budget")
+    if memory_budget and (observe or keyframes > 1):
+        raise click.BadParameter("out-of-core runs store whole frames of their views, use --frame-every",
+                                 param_hint="--memory-budget")
+    if frame_every and not memory_budget:
+        raise click.BadParameter("only out-of-core runs store frames every k ticks, use --keyframes",
+                                 param_hint="--frame-every")
+    if (checkpoint or checkpoint_every) and (engine is Engine.SHARDED or memory_budget):
+        raise click.BadParameter("checkpoints need the views in process memory", param_hint="--checkpoint")
+
+    params = dict(repetitions=repetitions, ticks=ticks, nodes_amount=nodes_amount, fanout=fanout, c=c, s=s,
+                  p=p, d=d, tail=tail, partitions=partitions, influx=influx, influx_host=influx_host, folder=folder,
+                  engine=engine, batched=batched, topology=topology, degree=degree, rewire=rewire,
+                  keyframes=keyframes, observe=observe, snapshots=snapshots, check_stats=check_stats,
+                  asynchronous=asynchronous, jitter=jitter, latency=latency, workers=workers,
+                  memory_budget=memory_budget, frame_every=frame_every, checkpoints=checkpoint,
+                  checkpoint_every=checkpoint_every)
+    simulation_id = simulation_run_id(params, seed)
     output_file = os.path.join(folder,
                                f"{simulation_id}.partition.pex.sim") if folder else f"{simulation_id}.partition.pex.sim"
-    with open(output_file, "a") as file:
-        file.write(f"{nodes_amount} {repetitions} \n")
-    partitions = [(int(p.split(":")[0]), int(p.split(":")[1])) for p in partition]
-    partition_type = PartitionType.RAND
-
-    for rep in range(repetitions):
-        global nodes
-        run_id = "".join(random.choices(string.
-                                        ascii_lowercase + string.digits, k=16))
-        write_info_to_file(run_id, {"S": s, "P": p, "D": d, "c": c, "tail": tail}, folder)
-
-        c0 = Cluster(fanout, c, s, p, d, tail)
-        nodes = [Node(node_id) for node_id in range(nodes_amount)]
-        c0.initialize_nodes(nodes)
-        c0.initialize_overlay(Topology.RING)
-
-        print(f"{nodes_amount} - Run {run_id} ({rep + 1}/{repetitions}) started")
-        for tick in range(1, ticks + 1):
-            print(f"N={nodes_amount}({rep + 1}/{repetitions}) - Tick {tick}/{ticks}...")
-            for partition_tick, partition_size in partitions:
-                if partition_tick and tick == partition_tick:
-                    pnodes = partition_nodes(partition_type, list(c0.nodes.values()), partition_size)
-                    c0.partition(pnodes)
-                    print(f"Partitioned: {c0}")
-
-            c0.simulate_tick(tick)
-            if influx:
-                write_to_influx(c0, run_id, tick)
-            if not influx:
-                write_to_file(c0, run_id, tick, folder)
-        print(f"{nodes_amount} - Run {run_id} ({rep + 1}/{repetitions}) finished - {c0}")
-        with open(output_file, "a") as file:
-            file.write(f"{os.path.join(folder, run_id)}\n")
+    reps = range(first_repetition, first_repetition + repetitions)
+    # Repetitions run again, e.g. with --first-repetition, join the runs already in the index.
+    runs = read_index(output_file)
+    write_index(output_file, nodes_amount, runs)
+    print(f"Seed {seed}")
+
+    def finished(run: str):
+        if run not in runs:
+            runs.append(run)
+        write_index(output_file, nodes_amount, runs)
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(run_simulation, seed, rep, **params) for rep in reps]
+            for future in as_completed(futures):
+                finished(future.result())
+    else:
+        for rep in reps:
+            finished(run_simulation(seed, rep, **params))
     print(f"Results stored at {output_file}")
 
 
+@cli2.command()
+@click.option("-g", "--grid", multiple=True, type=str,
+              help="Values of one parameter, e.g. 'c=16,32'. The sweep runs the product of all grids.")
+@click.option("--points", type=click.Path(exists=True, dir_okay=False),
+              help="File with one parameter point per line, e.g. 'c=32 S=2 D=0.5', instead of a grid.")
+@click.option("-t", "--ticks", type=int, default=50)
+@click.option("-r", "--repetitions", type=int, default=1)
+@click.option("-p", "--partition", multiple=True, type=str)
+@click.option("--influx", is_flag=True)
+@click.option("--influx-host", type=str, default="localhost:8086")
+@click.option("--folder", required=True, type=click.Path(file_okay=False),
+              help="Output folder; its summary table is used to resume the sweep.")
+@click.option("-e", "--engine", type=click.Choice(["object", "array", "sharded"]), default="object")
+@click.option("-b", "--batched/--sequential", default=None, help="Defaults to batched ticks for the array engine.")
+@click.option("--topology", type=click.Choice(["ring", "rand", "regular", "small-world", "star", "seed"]),
+              default="ring")
+@click.option("--degree", type=int, default=4)
+@click.option("--rewire", type=float, default=0.1)
+@click.option("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of simulations run in parallel.")
+@click.option("--seed", type=int, help="Master seed; defaults to the one of the sweep being resumed.")
+@click.option("-k", "--keyframes", type=int, default=1)
+@click.option("-o", "--observe", multiple=True, type=click.Choice(list(METRICS)))
+@click.option("--snapshots/--no-snapshots", default=True)
+def sweep(grid: List[str], points: str, ticks: int, repetitions: int, partition: List[str], influx: bool,
+          influx_host: str, folder: str, engine: str, batched: bool, topology: str, degree: int, rewire: float,
+          jobs: int, seed: int, keyframes: int, observe: List[str], snapshots: bool):
+    os.makedirs(folder, exist_ok=True)
+    summary_file = os.path.join(folder, "sweep.pex.tsv")
+    done = read_summary(summary_file)
+    if seed is None:
+        seed = int(done[0]["seed"]) if done else np.random.SeedSequence().entropy
+    done = {row["run"] for row in done}
+    if batched is None:
+        batched = engine == "array"
+
+    defaults = {"nodes": 3, "fanout": 1, "c": 32, "S": 0, "P": 0, "D": 0.5, "tail": False, "ticks": ticks,
+                "engine": engine, "topology": topology, "partition": " ".join(partition)}
+    params = dict(repetitions=repetitions, ticks=ticks,
+                  partitions=[(int(p.split(":")[0]), int(p.split(":")[1])) for p in partition],
+                  influx=influx, influx_host=influx_host, folder=folder, engine=Engine.from_string(engine),
+                  batched=batched, topology=Topology.from_string(topology), degree=degree, rewire=rewire,
+                  keyframes=keyframes, observe=observe, snapshots=snapshots)
+    jobs_queue = []
+    for point in sweep_points(grid, points):
+        point = {**defaults, **point}
+        for rep in range(repetitions):
+            run_id = sweep_run_id(point, seed, rep)
+            if run_id not in done:
+                jobs_queue.append((run_id, point, rep))
+    print(f"Seed {seed}: {len(jobs_queue)} simulations to run, {len(done)} already completed")
+
+    # Keep at most two simulations per worker in flight instead of queueing the whole sweep.
+    pending = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while jobs_queue or pending:
+            while jobs_queue and len(pending) < 2 * jobs:
+                run_id, point, rep = jobs_queue.pop(0)
+                future = executor.submit(run_simulation, seed, rep, nodes_amount=point["nodes"],
+                                         fanout=point["fanout"], c=point["c"], s=point["S"], p=point["P"],
+                                         d=point["D"], tail=point["tail"], run_id=run_id, **params)
+                pending[future] = (run_id, point, rep)
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                run_id, point, rep = pending.pop(future)
+                future.result()
+                append_summary(summary_file, {"run": run_id, **point, "seed": seed, "repetition": rep})
+    print(f"Summary stored at {summary_file}")
+
+
+@cli2.command()
+@click.argument("checkpoint", type=click.Path(exists=True, dir_okay=False))
+@click.option("-t", "--ticks", type=int, help="Last tick; defaults to the one the run was started with.")
+def resume(checkpoint: str, ticks: int):
+    # Continues the run in its own files, wherever they were moved, dropping whatever it stored
+    # after the checkpoint.
+    params, tick = read_checkpoint(checkpoint)
+    params["ticks"] = ticks or params["ticks"]
+    params["folder"] = checkpoint_folder(checkpoint)
+    print(f"Resuming run {params['run_id']} from tick {tick}")
+    run_simulation(**params, resume_from=checkpoint)
+
+
+@cli2.command()
+@click.argument("checkpoint", type=click.Path(exists=True, dir_okay=False))
+@click.option("-g", "--grid", multiple=True, type=str,
+              help="Values of S, P, D or partition, e.g. 'D=0.5,0.9' or 'partition=250:1000,250:1000+300:500'. "
+                   "The fork runs a branch for every combination.")
+@click.option("--points", type=click.Path(exists=True, dir_okay=False),
+              help="File with one branch per line, e.g. 'S=2 partition=250:1000', instead of a grid.")
+@click.option("-t", "--ticks", type=int, help="Last tick of the branches; defaults to the one of the checkpointed run.")
+@click.option("--folder", type=click.Path(file_okay=False),
+              help="Output folder of the branches; defaults to the one of the checkpointed run.")
+@click.option("-j", "--jobs", type=int, default=1, help="Number of branches run in parallel.")
+def fork(checkpoint: str, grid: List[str], points: str, ticks: int, folder: str, jobs: int):
+    parent, start = read_checkpoint(checkpoint)
+    folder = folder or checkpoint_folder(checkpoint)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    summary_file = os.path.join(folder or "", f"{parent['run_id']}.{start}.fork.pex.tsv")
+    done = {row["run"] for row in read_summary(summary_file)}
+    # Partitions made up to the checkpoint are part of its state, branches replace the later ones.
+    earlier = [(t, size) for t, size in parent["partitions"] if t <= start]
+    later = [(t, size) for t, size in parent["partitions"] if t > start]
+    branches = []
+    for point in sweep_points(grid, points, FORK_PARAMS):
+        if any(t <= start for t, _ in point.get("partition", [])):
+            raise click.BadParameter(f"partitions of a branch must come after the checkpoint at tick {start}",
+                                     param_hint="--grid")
+        key = ",".join(f"{name}={value}" for name, value in sorted(point.items()))
+        run_id = hashlib.sha1(f"{parent['run_id']},{start},{key}".encode()).hexdigest()[:16]
+        params = {**parent, "ticks": ticks or parent["ticks"], "folder": folder, "run_id": run_id,
+                  "s": point.get("S", parent["s"]), "p": point.get("P", parent["p"]),
+                  "d": point.get("D", parent["d"]), "partitions": earlier + point.get("partition", later)}
+        if run_id not in done:
+            branches.append(params)
+    print(f"Fork of run {parent['run_id']} at tick {start}: {len(branches)} branches to run, {len(done)} already "
+          f"completed")
+
+    def finished(params: Dict[str, object]):
+        append_summary(summary_file, {
+            "run": params["run_id"], "nodes": params["nodes_amount"], "fanout": params["fanout"], "c": params["c"],
+            "S": params["s"], "P": params["p"], "D": params["d"], "tail": params["tail"], "ticks": params["ticks"],
+            "engine": params["engine"].name.lower(), "topology": params["topology"].name.lower().replace("_", "-"),
+            "partition": " ".join(f"{t}:{size}" for t, size in params["partitions"]), "seed": params["seed"],
+            "repetition": params["rep"]})
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(run_simulation, **params, resume_from=checkpoint): params
+                       for params in branches}
+            for future in as_completed(futures):
+                future.result()
+                finished(futures[future])
+    else:
+        for params in branches:
+            run_simulation(**params, resume_from=checkpoint)
+            finished(params)
+    print(f"Summary stored at {summary_file}")
+
+
+class DefaultCommandCollection(click.CommandCollection):
+    # pex.py ran a simulation before it had other commands: arguments that do not start with a
+    # command name still go to simulate.
+    def parse_args(self, ctx, args):
+        if not args or args[0] not in self.list_commands(ctx) and args[0] not in self.get_help_option_names(ctx):
+            args = ["simulate", *args]
+        return super().parse_args(ctx, args)
+
+
+cli = DefaultCommandCollection(sources=[cli1, cli2], help="Without a command name, runs simulate.")
+
 if __name__ == '__main__':
-    simulate()
+    cli()
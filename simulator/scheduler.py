@@ -0,0 +1,67 @@
+import heapq
+from enum import IntEnum, auto
+
+import numpy as np
+
+
+class Message(IntEnum):
+    TIMER = auto()
+    REQUEST = auto()
+    RESPONSE = auto()
+
+
+class EventScheduler:
+    # Asynchronous push-pull: every node gossips on its own timer, one interval apart give or
+    # take `jitter`, and each message arrives after an exponentially distributed latency. An
+    # exchange is the sequential one split at the network: the initiator pushes its records as
+    # a request; on delivery the partner pushes its own back as the response and then pulls the
+    # request; the initiator pulls the response when it arrives. Only nodes with due events are
+    # touched, so the cost is per event and not per node and tick. Time is in ticks.
+    def __init__(self, cluster, interval: float = 1.0, jitter: float = 0.1, latency: float = 0.05,
+                 rng: np.random.Generator = None):
+        self.cluster = cluster
+        self.interval = interval
+        self.jitter = jitter
+        self.latency = latency
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.time = 0.0
+        self.events = 0
+        self._sequence = 0
+        self._queue = []
+        members = np.asarray(cluster.member_indices()).tolist()
+        for node, phase in zip(members, self.rng.uniform(0, interval, len(members)).tolist()):
+            self._schedule(phase, Message.TIMER, node)
+
+    def simulate_tick(self, i: int):
+        self.run_until(i * self.interval)
+        self.cluster.tick += 1
+        self.cluster.notify(i)
+
+    def run_until(self, time: float):
+        queue, cluster = self._queue, self.cluster
+        while queue and queue[0][0] < time:
+            self.time, _, kind, node, peer, payload = heapq.heappop(queue)
+            self.events += 1
+            if kind is Message.TIMER:
+                # Partitioned nodes stop gossiping, as they do in synchronous ticks.
+                if not cluster.is_member(node):
+                    continue
+                for partner in cluster.partners(node):
+                    self._schedule(self.time + self._delay(), Message.REQUEST, partner, node,
+                                   cluster.send(node, partner))
+                self._schedule(self.time + self.interval * (1 + self.rng.uniform(-self.jitter, self.jitter)),
+                               Message.TIMER, node)
+            elif kind is Message.REQUEST:
+                self._schedule(self.time + self._delay(), Message.RESPONSE, peer, node, cluster.send(node, peer))
+                cluster.receive(node, peer, payload)
+            else:
+                cluster.receive(node, peer, payload)
+        self.time = max(self.time, time)
+
+    def _delay(self) -> float:
+        return self.rng.exponential(self.latency) if self.latency > 0 else 0.0
+
+    def _schedule(self, time: float, kind: Message, node: int, peer: int = -1, payload=None):
+        # The sequence number breaks ties in order of scheduling and keeps payloads out of comparisons.
+        self._sequence += 1
+        heapq.heappush(self._queue, (time, self._sequence, kind, node, peer, payload))
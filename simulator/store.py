@@ -0,0 +1,206 @@
+import json
+import os.path
+from enum import IntEnum, auto
+from typing import Dict, Tuple
+
+import networkx as nx
+import numpy as np
+
+# A run store is a single file: the magic, a little-endian uint32 header length, a JSON header
+# padded to a multiple of 64 bytes, then one fixed-size frame per tick. A frame holds the
+# cluster and the view size of every node and the concatenated views, padded to nodes * c, in
+# the narrowest unsigned integers that fit, as listed under "dtypes" in the header. Stores
+# written before have no dtypes: int32 clusters and indices and an int64 indptr instead of sizes.
+# With keyframes every k ticks only ticks 1, k + 1, 2k + 1... get a frame, and the changes of
+# every tick go to an append-only event log next to it, each tick closed by a TICK event.
+# Stores in the views layout instead hold the views of the array engine as they are: one record
+# per node with its cluster, fill count and padded peers and hops. Out-of-core runs map theirs
+# as their state.
+RUN_MAGIC = b"PEXRUN01"
+RUN_SUFFIX = "pex.run"
+LOG_SUFFIX = "pex.log"
+EVENT_DTYPE = np.dtype([("tick", "<i4"), ("src", "<i4"), ("dst", "<i4"), ("op", "u1")])
+
+
+class Event(IntEnum):
+    ADD = auto()
+    REMOVE = auto()
+    CLUSTER = auto()
+    TICK = auto()
+
+Snapshot = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def frame_dtypes(nodes: int, c: int) -> Dict[str, str]:
+    return {"cluster": "<u2", "fill": "<u1" if c < 2 ** 8 else "<u2", "indices": "<u2" if nodes <= 2 ** 16 else "<u4"}
+
+
+def frame_dtype(nodes: int, capacity: int, dtypes: Dict[str, str] = None) -> np.dtype:
+    if dtypes is None:
+        return np.dtype([("tick", "<i4"), ("cluster", "<i4", (nodes,)), ("indptr", "<i8", (nodes + 1,)),
+                         ("indices", "<i4", (capacity,))])
+    return np.dtype([("tick", "<i4"), ("cluster", dtypes["cluster"], (nodes,)), ("fill", dtypes["fill"], (nodes,)),
+                     ("indices", dtypes["indices"], (capacity,))])
+
+
+def views_frame_dtype(nodes: int, c: int) -> np.dtype:
+    # One record per node, so the view of a node is a single contiguous span of the file.
+    node = np.dtype([("cluster", "<i4"), ("fill", "<i4"), ("peers", "<i4", (c,)), ("hops", "<i4", (c,))])
+    return np.dtype([("tick", "<i4"), ("nodes", node, (nodes,))])
+
+
+def write_header(file, header: dict) -> int:
+    # Returns the offset of the first frame.
+    header = json.dumps(header).encode()
+    header += b" " * (-(len(RUN_MAGIC) + 4 + len(header)) % 64)
+    file.write(RUN_MAGIC + np.uint32(len(header)).tobytes() + header)
+    return len(RUN_MAGIC) + 4 + len(header)
+
+
+def read_header(path: str) -> Tuple[dict, int]:
+    # Returns the header and the offset of the first frame.
+    with open(path, "rb") as file:
+        if file.read(len(RUN_MAGIC)) != RUN_MAGIC:
+            raise ValueError(f"{path} is not a PeX run store")
+        length = int(np.frombuffer(file.read(4), dtype="<u4")[0])
+        return json.loads(file.read(length)), len(RUN_MAGIC) + 4 + length
+
+
+def copy_run(src: str, dst: str, tick: int):
+    # Keep the first `tick` ticks of a run store and its event log, in place or as a new run.
+    header, offset = read_header(src)
+    keyframes = header["keyframes"]
+    frames = (tick + keyframes - 1) // keyframes
+    dtype = frame_dtype(header["nodes"], header["capacity"], header.get("dtypes"))
+    sizes = [(src, dst, offset + frames * dtype.itemsize)]
+    if os.path.isfile(log_path(src)):
+        events = np.fromfile(log_path(src), dtype=EVENT_DTYPE)
+        sizes.append((log_path(src), log_path(dst), np.searchsorted(events["tick"], tick, side="right") *
+                      EVENT_DTYPE.itemsize))
+    for src_file, dst_file, size in sizes:
+        if os.path.abspath(src_file) == os.path.abspath(dst_file):
+            os.truncate(src_file, size)
+            continue
+        with open(src_file, "rb") as source, open(dst_file, "wb") as target:
+            while size > 0:
+                block = source.read(min(size, 1 << 24))
+                target.write(block)
+                size -= len(block)
+
+
+def snapshot_edges(snapshot: Snapshot) -> np.ndarray:
+    _, indptr, indices = snapshot
+    return np.stack((np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr)), indices), axis=1)
+
+
+def snapshot_to_networkx(snapshot: Snapshot) -> nx.DiGraph:
+    cluster = snapshot[0]
+    graph = nx.DiGraph()
+    graph.add_nodes_from((i, {"cluster": int(c)}) for i, c in enumerate(cluster.tolist()))
+    graph.add_edges_from(snapshot_edges(snapshot).tolist())
+    return graph
+
+
+def run_path(run_id: str, folder: str) -> str:
+    folder = os.path.join(folder, run_id) if folder else run_id
+    return os.path.join(folder, f"{run_id}.{RUN_SUFFIX}")
+
+
+def log_path(path: str) -> str:
+    return path[:-len(RUN_SUFFIX)] + LOG_SUFFIX
+
+
+class RunWriter:
+    # With `append` the writer continues an existing store, cut with copy_run to the last tick to
+    # keep, in the frame format it was written with.
+    def __init__(self, path: str, nodes: int, c: int, keyframes: int = 1, append: bool = False):
+        self.path = path
+        self.nodes = nodes
+        self.capacity = nodes * c
+        self.keyframes = keyframes
+        self.dtypes = read_header(path)[0].get("dtypes") if append else frame_dtypes(nodes, c)
+        self.dtype = frame_dtype(nodes, self.capacity, self.dtypes)
+        self._frame = np.zeros(1, dtype=self.dtype)
+        mode = "ab" if append else "wb"
+        self._file = open(path, mode)
+        self._log = open(log_path(path), mode) if keyframes > 1 else None
+        self._edges = None
+        self._cluster = None
+        if not append:
+            write_header(self._file, {"nodes": nodes, "c": c, "capacity": self.capacity, "keyframes": keyframes,
+                                      "dtypes": self.dtypes})
+
+    def resume(self, snapshot: Snapshot):
+        # The event log goes on from the overlay of the last stored tick.
+        self._edges = self._sorted_edges(snapshot)
+        self._cluster = np.array(snapshot[0], copy=True)
+
+    def write(self, tick: int, snapshot: Snapshot):
+        if (tick - 1) % self.keyframes == 0:
+            self._write_frame(tick, snapshot)
+        if self._log:
+            self._write_events(tick, snapshot)
+
+    def _write_frame(self, tick: int, snapshot: Snapshot):
+        cluster, indptr, indices = snapshot
+        if len(indices) > self.capacity:
+            raise ValueError(f"Snapshot of tick {tick} has more than {self.capacity} records")
+        frame = self._frame[0]
+        frame["tick"] = tick
+        if self.dtypes is None:
+            frame["indptr"] = indptr
+        else:
+            if len(cluster) and cluster.max() > np.iinfo(self.dtypes["cluster"]).max:
+                raise ValueError(f"Snapshot of tick {tick} has more clusters than the store holds")
+            fill = np.diff(indptr)
+            if len(fill) and fill.max() > np.iinfo(self.dtypes["fill"]).max:
+                raise ValueError(f"Snapshot of tick {tick} has views of more than "
+                                 f"{np.iinfo(self.dtypes['fill']).max} records")
+            frame["fill"] = fill
+        frame["cluster"] = cluster
+        frame["indices"][:len(indices)] = indices
+        frame["indices"][len(indices):] = 0
+        self._file.write(self._frame.tobytes())
+
+    def _write_events(self, tick: int, snapshot: Snapshot):
+        cluster = snapshot[0]
+        edges = self._sorted_edges(snapshot)
+        if self._edges is None:
+            removed = added = changed = np.arange(0)
+        else:
+            removed = np.setdiff1d(self._edges, edges, assume_unique=True)
+            added = np.setdiff1d(edges, self._edges, assume_unique=True)
+            changed = np.flatnonzero(cluster != self._cluster)
+        self._edges = edges
+        self._cluster = np.array(cluster, copy=True)
+
+        events = np.empty(len(removed) + len(added) + len(changed) + 1, dtype=EVENT_DTYPE)
+        events["tick"] = tick
+        start = 0
+        for op, src, dst in ((Event.REMOVE, removed // self.nodes, removed % self.nodes),
+                             (Event.ADD, added // self.nodes, added % self.nodes),
+                             (Event.CLUSTER, changed, cluster[changed])):
+            end = start + len(src)
+            events["src"][start:end] = src
+            events["dst"][start:end] = dst
+            events["op"][start:end] = op
+            start = end
+        events[-1] = (tick, -1, -1, Event.TICK)
+        self._log.write(events.tobytes())
+
+    def _sorted_edges(self, snapshot: Snapshot) -> np.ndarray:
+        _, indptr, indices = snapshot
+        edges = np.repeat(np.arange(self.nodes, dtype=np.int64), np.diff(indptr)) * self.nodes + indices
+        edges.sort()
+        return edges
+
+    def close(self):
+        self._file.close()
+        if self._log:
+            self._log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,98 @@
+import os
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from engine import ArrayCluster
+from pex import Engine, new_cluster
+from store import snapshot_to_networkx
+from topology import Topology, build_views, cap_views
+
+NODES = 200
+C = 8
+TICKS = 15
+
+
+def converge(engine: Engine, batched: bool = False, workers: int = 1, nodes_amount: int = NODES):
+    # The object engine draws from the global streams.
+    random.seed(1)
+    np.random.seed(1)
+    rng = np.random.default_rng(1)
+    cluster = new_cluster(engine, nodes_amount, 1, C, 2, 3, 0.5, False, batched, rng, workers)
+    cluster.initialize_overlay(build_views(Topology.RING, nodes_amount, rng=rng))
+    try:
+        for tick in range(1, TICKS + 1):
+            cluster.simulate_tick(tick)
+        return tuple(np.array(array) for array in cluster.snapshot())
+    finally:
+        if engine is Engine.SHARDED:
+            cluster.close()
+
+
+def check_overlay(snapshot):
+    _, indptr, indices = snapshot
+    degree = np.diff(indptr)
+    # From the views of a ring, every view fills up to c and the overlay mixes into one component.
+    assert degree.mean() > 0.95 * C
+    assert degree.max() <= C
+    for i in range(NODES):
+        view = indices[indptr[i]:indptr[i + 1]]
+        assert i not in view
+        assert len(np.unique(view)) == len(view)
+    graph = snapshot_to_networkx(snapshot)
+    assert nx.is_weakly_connected(graph)
+    return graph
+
+
+@pytest.mark.parametrize("engine,workers", [(Engine.OBJECT, 1), (Engine.ARRAY, 1), (Engine.SHARDED, 1),
+                                            (Engine.SHARDED, 2)])
+def test_convergence(engine, workers):
+    graph = check_overlay(converge(engine, workers=workers))
+    reference = check_overlay(converge(Engine.OBJECT))
+    assert nx.is_strongly_connected(graph)
+    # Far from the ring, whose shortest paths average NODES / 4 hops.
+    assert nx.average_shortest_path_length(graph) < 1.2 * nx.average_shortest_path_length(reference)
+    indegree, expected = np.array([d for _, d in graph.in_degree]), np.array([d for _, d in reference.in_degree])
+    assert abs(indegree.std() - expected.std()) < 0.25 * expected.std()
+
+
+def test_convergence_batched():
+    # Simultaneous exchanges skew the indegrees, so batched ticks are only checked for full views
+    # and a single component.
+    check_overlay(converge(Engine.ARRAY, batched=True))
+
+
+def test_sharded_reproducible():
+    first, second = converge(Engine.SHARDED, workers=2), converge(Engine.SHARDED, workers=2)
+    assert all(np.array_equal(a, b) for a, b in zip(first, second))
+
+
+def test_sharded_worker_failure(monkeypatch):
+    def fail(*args):
+        raise ValueError("broken exchange")
+
+    # The workers fork after the patch and fail in their first exchange.
+    monkeypatch.setattr(ArrayCluster, "_push_batched", fail)
+    segments = set(os.listdir("/dev/shm"))
+    with pytest.raises(RuntimeError, match="broken exchange"):
+        converge(Engine.SHARDED, workers=2)
+    assert set(os.listdir("/dev/shm")) <= segments
+
+
+@pytest.mark.parametrize("topology", [Topology.STAR, Topology.SEED])
+def test_initial_views_capped(topology):
+    # Views wider than c are capped the same way for every engine, so they all start alike.
+    snapshots = []
+    for engine in (Engine.OBJECT, Engine.ARRAY):
+        rng = np.random.default_rng(5)
+        cluster = new_cluster(engine, NODES, 1, C, 0, 0, 0.5, False, rng=rng)
+        cluster.initialize_overlay(cap_views(build_views(topology, NODES, 12, rng=rng), C, rng))
+        snapshots.append(cluster.snapshot())
+    assert np.diff(snapshots[0][1]).max() == C
+    assert all(np.array_equal(a, b) for a, b in zip(*snapshots))
+    for engine in (Engine.OBJECT, Engine.ARRAY):
+        cluster = new_cluster(engine, NODES, 1, C, 0, 0, 0.5, False)
+        cluster.initialize_overlay(build_views(topology, NODES, 12))
+        assert np.diff(cluster.snapshot()[1]).max() == C
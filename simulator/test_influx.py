@@ -0,0 +1,106 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from influx import InfluxWriter, view_lines
+
+
+class Server(HTTPServer):
+    # Stands in for InfluxDB's /write endpoint, keeping every request body; requests wait for
+    # `gate`, so a test can make the server slow.
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.requests = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.server.gate.wait()
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        url = urlparse(self.path)
+        self.server.requests.append((url.path, parse_qs(url.query), body.decode()))
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.gate.set()
+    server.shutdown()
+    thread.join()
+
+
+def writer(server, **kwargs):
+    return InfluxWriter("127.0.0.1", server.server_address[1], **kwargs)
+
+
+def bodies(server):
+    return [body for _, _, body in server.requests]
+
+
+def test_batches_line_protocol(server):
+    ticks = [view_lines([(0, [1, 2], 0), (1, [], 1)], "run 1", tick, 100 + tick) for tick in (1, 2)]
+    influx = writer(server, batch_size=3, flush_interval=60)
+    # Two views are below the batch size; the views of the next tick fill the batch.
+    influx.write(ticks[0])
+    influx.write(ticks[1])
+    influx.flush()
+    path, query, body = server.requests[0]
+    assert path == "/write" and query == {"db": ["testground"], "precision": ["s"]}
+    assert body == "\n".join(ticks[0] + ticks[1]) + "\n"
+    assert body.splitlines()[:2] == [
+        "diagnostics.casm-pex-convergence.view.point,cluster=0,node=0,records=1-2,run=run\\ 1,tick=1 value=0.0 101",
+        "diagnostics.casm-pex-convergence.view.point,cluster=1,node=1,run=run\\ 1,tick=1 value=0.0 101",
+    ]
+    influx.close()
+    assert len(server.requests) == 1 and influx.points == 4
+
+
+def test_close_flushes(server):
+    influx = writer(server, batch_size=1000, flush_interval=60)
+    lines = view_lines([(i, [i + 1], 0) for i in range(5)], "run", 1, 100)
+    influx.write(lines)
+    assert server.requests == []
+    influx.close()
+    assert bodies(server) == ["\n".join(lines) + "\n"]
+
+
+def test_flush_interval(server):
+    influx = writer(server, batch_size=1000, flush_interval=0.1)
+    lines = view_lines([(0, [1], 0)], "run", 1, 100)
+    influx.write(lines)
+    deadline = time.monotonic() + 5
+    while not server.requests and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert bodies(server) == ["\n".join(lines) + "\n"]
+    influx.close()
+
+
+def test_backpressure(server):
+    # One batch is being sent and two wait in the queue: the fourth blocks the caller until the
+    # server answers.
+    server.gate.clear()
+    influx = writer(server, batch_size=1, flush_interval=60, max_batches=2)
+    lines = view_lines([(i, [i + 1], 0) for i in range(4)], "run", 1, 100)
+    caller = threading.Thread(target=influx.write, args=(lines,))
+    caller.start()
+    caller.join(0.5)
+    assert caller.is_alive() and server.requests == []
+    server.gate.set()
+    caller.join(5)
+    assert not caller.is_alive()
+    influx.close()
+    assert bodies(server) == [line + "\n" for line in lines]
+    assert influx.points == 4
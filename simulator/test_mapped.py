@@ -0,0 +1,64 @@
+import numpy as np
+
+from engine import ArrayCluster, ViewState
+from mapped import MappedCluster, MappedViewState
+from store import read_header, views_frame_dtype
+from topology import Topology, build_views
+
+
+def run(cluster, ticks: int = 6):
+    cluster.initialize_nodes(np.arange(cluster.state.nodes_amount))
+    cluster.initialize_overlay(build_views(Topology.RING, cluster.state.nodes_amount))
+    for tick in range(1, ticks + 1):
+        if tick == 3:
+            cluster.partition(np.arange(0, cluster.state.nodes_amount, 3))
+        cluster.simulate_tick(tick)
+    return cluster.snapshot()
+
+
+def mapped(path, nodes_amount: int, memory_budget: int, frame_every: int = 0):
+    state = MappedViewState(str(path), nodes_amount, 8)
+    return MappedCluster(state, 1, 8, 2, 3, 0.5, False, np.random.default_rng(3), memory_budget, frame_every)
+
+
+def test_single_chunk(tmp_path):
+    # A budget holding all the nodes runs the same batched ticks as the in-memory engine.
+    cluster = mapped(tmp_path / "run.pex.run", 300, 1024)
+    assert cluster.chunk_size >= 300
+    expected = run(ArrayCluster(ViewState(300, 8), 1, 8, 2, 3, 0.5, False, np.random.default_rng(3), batched=True))
+    assert all(np.array_equal(a, b) for a, b in zip(run(cluster), expected))
+    cluster.close(unlink=True)
+
+
+def test_chunks(tmp_path):
+    cluster = mapped(tmp_path / "run.pex.run", 2000, 1)
+    assert cluster.chunk_size < 2000
+    cluster_of, indptr, indices = run(cluster, 10)
+    assert np.count_nonzero(cluster_of) == len(range(0, 2000, 3))
+    degree = np.diff(indptr)
+    assert degree.mean() > 7 and degree.max() <= 8
+    src = np.repeat(np.arange(2000), degree)
+    assert not np.any(src == indices)
+    assert len(np.unique(src.astype(np.int64) * 2000 + indices)) == len(indices)
+    cluster.close(unlink=True)
+    assert not (tmp_path / "run.pex.run").exists()
+
+
+def test_frame_every(tmp_path):
+    path = str(tmp_path / "run.pex.run")
+    cluster = mapped(path, 500, 1, frame_every=2)
+    state, views = cluster.state, {}
+    cluster.observe(lambda tick, snapshot: views.update({tick: (state.cluster.copy(), state.fill.copy(),
+                                                                state.peers.copy())}))
+    run(cluster, 5)
+    # Copies of more than one block.
+    state.append_frame(block_size=4096)
+    cluster.close()
+    header, offset = read_header(path)
+    frames = np.fromfile(path, dtype=views_frame_dtype(header["nodes"], header["c"]), offset=offset)
+    assert frames["tick"].tolist() == [5, 2, 4, 5]
+    for frame in frames:
+        cluster_of, fill, peers = views[int(frame["tick"])]
+        assert np.array_equal(frame["nodes"]["cluster"], cluster_of)
+        assert np.array_equal(frame["nodes"]["fill"], fill)
+        assert np.array_equal(frame["nodes"]["peers"], peers)
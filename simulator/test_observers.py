@@ -0,0 +1,35 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from observers import METRICS
+from store import snapshot_to_networkx
+
+
+def snapshot(nodes: int = 80, c: int = 5, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    fill = rng.integers(0, c + 1, nodes)
+    indptr = np.zeros(nodes + 1, dtype=np.int64)
+    np.cumsum(fill, out=indptr[1:])
+    indices = np.concatenate([rng.choice(np.delete(np.arange(nodes), i), k, replace=False)
+                              for i, k in enumerate(fill)]).astype(np.int32)
+    return np.zeros(nodes, dtype=np.int32), indptr, indices
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sparse_metrics(seed):
+    # Every node sampled: the metrics match networkx over the whole overlay.
+    observed = snapshot(seed=seed)
+    graph = snapshot_to_networkx(observed)
+    clustering = METRICS["clustering"](1, None)
+    clustering.samples = graph.number_of_nodes()
+    assert clustering.compute(1, observed)[0] == pytest.approx(nx.average_clustering(graph))
+    connected, largest = METRICS["connectivity"](1, None).compute(1, observed)
+    assert connected == int(nx.is_weakly_connected(graph))
+    assert largest == max(map(len, nx.weakly_connected_components(graph))) / graph.number_of_nodes()
+    path = METRICS["path_length"](1, None)
+    path.sources = graph.number_of_nodes()
+    lengths = [d for _, targets in nx.shortest_path_length(graph) for d in targets.values() if d > 0]
+    mean, reachable = path.compute(1, observed)
+    assert mean == pytest.approx(np.mean(lengths))
+    assert reachable == pytest.approx(len(lengths) / (graph.number_of_nodes() * (graph.number_of_nodes() - 1)))
@@ -0,0 +1,113 @@
+import numpy as np
+import pytest
+
+from pex import Engine, new_cluster
+from scheduler import EventScheduler
+from topology import Topology, build_views
+
+
+class Recorder:
+    # A cluster of `n` nodes that gossip with the next node, recording the calls the scheduler makes.
+    def __init__(self, n: int):
+        self.n = n
+        self.tick = 0
+        self.members = set(range(n))
+        self.scheduler = None
+        self.calls = []
+
+    def member_indices(self):
+        return sorted(self.members)
+
+    def is_member(self, node):
+        return node in self.members
+
+    def partners(self, node):
+        return [(node + 1) % self.n]
+
+    def send(self, node, peer):
+        payload = object()
+        self.calls.append((self.scheduler.time, "send", node, peer, payload))
+        return payload
+
+    def receive(self, node, peer, payload):
+        self.calls.append((self.scheduler.time, "receive", node, peer, payload))
+
+    def notify(self, i):
+        pass
+
+
+def record(n: int, ticks: int, latency: float, seed: int = 0):
+    cluster = Recorder(n)
+    cluster.scheduler = EventScheduler(cluster, latency=latency, rng=np.random.default_rng(seed))
+    for tick in range(1, ticks + 1):
+        cluster.scheduler.simulate_tick(tick)
+    return cluster
+
+
+@pytest.mark.parametrize("latency", [0.0, 0.05, 2.0])
+def test_exchange_order(latency):
+    cluster = record(10, 5, latency)
+    times = [time for time, *_ in cluster.calls]
+    assert times == sorted(times)
+    sends = {payload: (time, node, peer) for time, call, node, peer, payload in cluster.calls if call == "send"}
+    received = {}
+    for time, call, node, peer, payload in cluster.calls:
+        if call == "receive":
+            # Every payload is received once, by the node it was sent to, no earlier than it was sent.
+            assert payload not in received
+            received[payload] = time
+            sent_at, sender, recipient = sends[payload]
+            assert (sender, recipient) == (peer, node) and sent_at <= time
+    exchanges = 0
+    for index, (time, call, node, peer, payload) in enumerate(cluster.calls):
+        if call == "receive" and node == (peer + 1) % 10:
+            # TIMER: the initiator pushes a request. REQUEST: the partner pushes its response and then
+            # pulls the request. RESPONSE: the initiator pulls the response, if it arrived in time.
+            _, call, sender, recipient, response = cluster.calls[index - 1]
+            assert (call, sender, recipient) == ("send", node, peer)
+            assert sends[response][0] == time and received.get(response, time) >= time
+            exchanges += 1
+    # Every node gossips about once per tick.
+    assert exchanges >= 10 * (4 if latency < 1 else 2)
+
+
+def test_timers():
+    cluster = record(10, 20, 0.0)
+    timers = {}
+    for time, call, node, peer, _ in cluster.calls:
+        if call == "send" and peer == (node + 1) % 10:
+            timers.setdefault(node, []).append(time)
+    for node, times in timers.items():
+        assert times[0] < 1
+        # One interval apart, give or take the jitter of 10%.
+        assert np.all(np.abs(np.diff(times) - 1) <= 0.1 + 1e-9)
+        assert len(times) in (19, 20, 21)
+
+
+def test_partitioned_nodes_stop():
+    cluster = record(10, 2, 0.05)
+    cluster.members -= {3}
+    before = len(cluster.calls)
+    for tick in range(3, 6):
+        cluster.scheduler.simulate_tick(tick)
+    assert not [call for call in cluster.calls[before:] if call[1] == "send" and call[2] == 3 and call[3] == 4]
+
+
+def run(seed: int):
+    rng = np.random.default_rng(seed)
+    cluster = new_cluster(Engine.ARRAY, 100, 1, 8, 2, 3, 0.5, False, rng=rng)
+    cluster.initialize_overlay(build_views(Topology.RING, 100, rng=rng))
+    scheduler = EventScheduler(cluster, rng=rng)
+    for tick in range(1, 6):
+        scheduler.simulate_tick(tick)
+    return scheduler.events, cluster.snapshot()
+
+
+def test_same_seed_same_run():
+    events, snapshot = run(3)
+    again, replayed = run(3)
+    assert events == again
+    for array, other in zip(snapshot, replayed):
+        assert np.array_equal(array, other)
+    _, other = run(4)
+    assert not all(len(a) == len(b) and np.array_equal(a, b) for a, b in zip(snapshot, other))
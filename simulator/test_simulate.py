@@ -0,0 +1,56 @@
+import glob
+import os
+
+from click.testing import CliRunner
+
+from pex import cli, read_index
+
+
+def simulate(folder, *args):
+    result = CliRunner().invoke(cli, ["simulate", "-n", "20", "-t", "3", "--seed", "11", "--folder", str(folder),
+                                      *args])
+    assert result.exit_code == 0, result.output
+    return sorted(glob.glob(os.path.join(str(folder), "*.partition.pex.sim")))
+
+
+def test_runs_named_by_parameters(tmp_path):
+    first = simulate(tmp_path, "-c", "8", "-r", "2")
+    second = simulate(tmp_path, "-c", "16", "-r", "2")
+    assert len(first) == 1 and len(second) == 2
+    indexes = [read_index(path) for path in second]
+    assert all(len(runs) == 2 for runs in indexes)
+    assert not set(indexes[0]) & set(indexes[1])
+    assert all(os.path.isdir(run) for runs in indexes for run in runs)
+
+
+def test_rerun_keeps_index(tmp_path):
+    index, = simulate(tmp_path, "-c", "8", "-r", "3")
+    runs = read_index(index)
+    with open(os.path.join(runs[1], "info.sim")) as file:
+        info = file.read()
+    assert simulate(tmp_path, "-c", "8", "-r", "1", "--first-repetition", "1") == [index]
+    assert read_index(index) == runs
+    with open(os.path.join(runs[1], "info.sim")) as file:
+        assert file.read() == info
+    with open(index) as file:
+        assert file.readline().split() == ["20", "3"]
+
+
+def test_default_command(tmp_path):
+    # Without a command name the arguments are simulate's.
+    index, = simulate(tmp_path, "-c", "8")
+    result = CliRunner().invoke(cli, ["-n", "20", "-t", "3", "--seed", "11", "--folder", str(tmp_path), "-c", "8",
+                                      "-r", "2"])
+    assert result.exit_code == 0, result.output
+    assert len(read_index(index)) == 2
+    usage = CliRunner().invoke(cli, ["--help"])
+    assert usage.exit_code == 0 and "simulate" in usage.output and "sweep" in usage.output
+
+
+def test_array_engine_batched_by_default(tmp_path):
+    index, = simulate(tmp_path, "-e", "array")
+    runs = read_index(index)
+    assert simulate(tmp_path, "-e", "array", "-b") == [index]
+    assert read_index(index) == runs
+    assert len(simulate(tmp_path, "-e", "array", "--sequential")) == 2
+    assert len(simulate(tmp_path, "-e", "array", "-a")) == 3
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from topology import cap_views, random_regular, star
+
+
+def assert_simple_regular(views, nodes_amount, degree):
+    assert len(views) == nodes_amount
+    assert np.all(np.diff(views.indptr) == degree)
+    edges = set()
+    for i in range(nodes_amount):
+        neighbors = views.neighbors(i)
+        assert i not in neighbors
+        assert len(set(neighbors)) == len(neighbors)
+        edges.update((i, int(j)) for j in neighbors)
+    assert all((j, i) in edges for i, j in edges)
+
+
+@pytest.mark.parametrize("nodes_amount,degree", [(6, 4), (39, 4), (7, 6), (10, 3), (50, 0), (200, 8), (31, 20)])
+def test_random_regular(nodes_amount, degree):
+    rng = np.random.default_rng(nodes_amount * degree)
+    for _ in range(5):
+        assert_simple_regular(random_regular(nodes_amount, degree, rng), nodes_amount, degree)
+
+
+def test_random_regular_small_cases():
+    rng = np.random.default_rng(0)
+    for nodes_amount in range(2, 40):
+        for degree in range(0, nodes_amount, 1 if nodes_amount % 2 == 0 else 2):
+            assert_simple_regular(random_regular(nodes_amount, degree, rng), nodes_amount, degree)
+
+
+def test_random_regular_impossible():
+    rng = np.random.default_rng(0)
+    with pytest.raises(ValueError):
+        random_regular(7, 3, rng)
+    with pytest.raises(ValueError):
+        random_regular(4, 4, rng)
+
+
+def test_cap_views():
+    views = star(50)
+    rng = np.random.default_rng(0)
+    assert cap_views(views, 49, rng) is views
+    capped = cap_views(views, 8, rng)
+    assert np.array_equal(np.diff(capped.indptr), [8] + [1] * 49)
+    hub = capped.neighbors(0)
+    assert len(set(hub)) == 8 and np.all(np.diff(hub) > 0) and 0 not in hub
+    assert all(np.array_equal(capped.neighbors(i), [0]) for i in range(1, 50))
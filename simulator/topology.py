@@ -0,0 +1,166 @@
+import random
+from enum import IntEnum, auto
+from typing import NamedTuple
+
+import numpy as np
+
+
+class Topology(IntEnum):
+    RING = auto()
+    RAND = auto()
+    REGULAR = auto()
+    SMALL_WORLD = auto()
+    STAR = auto()
+    SEED = auto()
+
+    @staticmethod
+    def from_string(name: str):
+        if name == "rand":
+            return Topology.RAND
+        if name == "ring":
+            return Topology.RING
+        if name == "regular":
+            return Topology.REGULAR
+        if name == "small-world":
+            return Topology.SMALL_WORLD
+        if name == "star":
+            return Topology.STAR
+        if name == "seed":
+            return Topology.SEED
+        raise ValueError("Invalid topology name")
+
+
+class Views(NamedTuple):
+    # Initial view of node i is indices[indptr[i]:indptr[i + 1]].
+    indptr: np.ndarray
+    indices: np.ndarray
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbors(self, i: int) -> np.ndarray:
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+
+def build_views(topology: Topology, nodes_amount: int, degree: int = 4, rewire: float = 0.1,
+                rng: np.random.Generator = None) -> Views:
+    rng = rng if rng is not None else np.random.default_rng()
+    if topology is Topology.RING:
+        return ring(nodes_amount)
+    if topology is Topology.RAND:
+        return permutation_ring(nodes_amount)
+    if topology is Topology.REGULAR:
+        return random_regular(nodes_amount, degree, rng)
+    if topology is Topology.SMALL_WORLD:
+        return small_world(nodes_amount, degree, rewire, rng)
+    if topology is Topology.STAR:
+        return star(nodes_amount)
+    if topology is Topology.SEED:
+        return seed_list(nodes_amount, degree, rng)
+    raise ValueError("Invalid topology")
+
+
+def cap_views(views: Views, c: int, rng) -> Views:
+    # Views wider than c (e.g. a star's hub) start from a random sample of c of their peers, in
+    # their order. rng is a Generator or np.random, for the engines drawing from the global state.
+    degree = np.diff(views.indptr)
+    if not np.any(degree > c):
+        return views
+    row = np.repeat(np.arange(len(views)), degree)
+    order = np.lexsort((rng.random(len(views.indices)), row))
+    rank = np.arange(len(order)) - np.repeat(views.indptr[:-1], degree)
+    kept = np.sort(order[rank < c])
+    indptr = np.zeros(len(views) + 1, dtype=np.int64)
+    np.cumsum(np.minimum(degree, c), out=indptr[1:])
+    return Views(indptr, views.indices[kept])
+
+
+def from_edges(nodes_amount: int, src: np.ndarray, dst: np.ndarray) -> Views:
+    keep = src != dst
+    edges = np.unique(src[keep].astype(np.int64) * nodes_amount + dst[keep])
+    src, dst = edges // nodes_amount, edges % nodes_amount
+    indptr = np.zeros(nodes_amount + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=nodes_amount), out=indptr[1:])
+    return Views(indptr, dst.astype(np.int32))
+
+
+def undirected(nodes_amount: int, src: np.ndarray, dst: np.ndarray) -> Views:
+    return from_edges(nodes_amount, np.concatenate((src, dst)), np.concatenate((dst, src)))
+
+
+def ring(nodes_amount: int) -> Views:
+    index = np.arange(nodes_amount)
+    return undirected(nodes_amount, index, (index + 1) % max(nodes_amount, 1))
+
+
+def permutation_ring(nodes_amount: int, seed: int = 1234) -> Views:
+    # Same layout as the original pairwise check: a ring over a seeded shuffle of the indices.
+    index = list(range(nodes_amount))
+    random.Random(seed).shuffle(index)
+    node = np.empty(nodes_amount, dtype=np.int64)
+    node[index] = np.arange(nodes_amount)
+    return undirected(nodes_amount, node, np.roll(node, -1))
+
+
+def random_regular(nodes_amount: int, degree: int, rng: np.random.Generator, attempts: int = 1000) -> Views:
+    # Configuration model: pair shuffled stubs, re-pairing only self loops and duplicates.
+    if (nodes_amount * degree) % 2 or degree >= nodes_amount:
+        raise ValueError(f"No {degree}-regular graph on {nodes_amount} nodes")
+    if 2 * degree >= nodes_amount:
+        # Dense graphs rarely come out of the stub pairing simple: take the complement of a sparse one.
+        sparse = random_regular(nodes_amount, nodes_amount - 1 - degree, rng, attempts)
+        linked = np.eye(nodes_amount, dtype=bool)
+        linked[np.repeat(np.arange(nodes_amount), np.diff(sparse.indptr)), sparse.indices] = True
+        return from_edges(nodes_amount, *np.nonzero(~linked))
+    stubs = np.repeat(np.arange(nodes_amount, dtype=np.int64), degree)
+    rng.shuffle(stubs)
+    src, dst = stubs[0::2], stubs[1::2]
+    for _ in range(attempts):
+        lo, hi = np.minimum(src, dst), np.maximum(src, dst)
+        key = lo * nodes_amount + hi
+        _, first = np.unique(key, return_index=True)
+        bad = np.ones(len(key), dtype=bool)
+        bad[first] = False
+        bad |= src == dst
+        if not bad.any():
+            break
+        good = np.flatnonzero(~bad)
+        bad = np.flatnonzero(bad)
+        if len(good) < len(bad):
+            # Too few simple pairs to break the others up: pair all the stubs again.
+            rng.shuffle(stubs)
+            continue
+        # Exchange an endpoint between every bad pair and its own distinct simple pair, so that
+        # every stub is kept.
+        other = rng.choice(good, size=len(bad), replace=False)
+        dst[bad], dst[other] = dst[other], dst[bad]
+    else:
+        raise RuntimeError(f"Could not build a simple {degree}-regular graph after {attempts} attempts")
+    views = undirected(nodes_amount, src, dst)
+    if np.any(np.diff(views.indptr) != degree):
+        raise RuntimeError(f"Built a graph that is not {degree}-regular")
+    return views
+
+
+def small_world(nodes_amount: int, degree: int, rewire: float, rng: np.random.Generator) -> Views:
+    # Watts-Strogatz: a ring lattice linking degree/2 neighbors on each side, then every lattice
+    # edge is rewired to a uniformly random target with probability `rewire`.
+    index = np.arange(nodes_amount, dtype=np.int64)
+    src = np.tile(index, max(degree // 2, 1))
+    dst = (src + np.repeat(np.arange(1, max(degree // 2, 1) + 1), nodes_amount)) % max(nodes_amount, 1)
+    rewired = rng.random(len(src)) < rewire
+    dst[rewired] = rng.integers(0, nodes_amount, size=rewired.sum())
+    return undirected(nodes_amount, src, dst)
+
+
+def star(nodes_amount: int, hub: int = 0) -> Views:
+    leaves = np.delete(np.arange(nodes_amount), hub) if nodes_amount else np.arange(0)
+    return undirected(nodes_amount, np.full(len(leaves), hub), leaves)
+
+
+def seed_list(nodes_amount: int, seeds: int, rng: np.random.Generator) -> Views:
+    # Every node starts from the same static list of seed peers, as with the boot package.
+    seeds = rng.choice(nodes_amount, size=min(seeds, nodes_amount), replace=False)
+    src = np.repeat(np.arange(nodes_amount, dtype=np.int64), len(seeds))
+    dst = np.tile(seeds, nodes_amount)
+    return from_edges(nodes_amount, src, dst)